@@ -0,0 +1,233 @@
+import asyncio
+from paging import iterate_raw_pages
+from throttling import RETRY_STATUSES, retry_delay
+
+# Graph accepts at most 20 requests in one JSON $batch envelope
+MAX_BATCH_SIZE = 20
+
+
+# Raised (per sub-request) when Graph answers a batched request with an error status
+
+class BatchItemError(Exception):
+    def __init__(self, request_id: str, status, body):
+        self.request_id = request_id
+        self.status = status
+        self.body = body
+        message = ''
+        if isinstance(body, dict) and isinstance(body.get('error'), dict):
+            message = body['error'].get('message', '')
+        super().__init__(f"Batch request {request_id} failed with status {status}: {message}")
+
+
+# Collects Graph requests and sends them as JSON $batch envelopes of up to 20 requests.
+# add() returns a future that resolves to the sub-response body, or raises BatchItemError for that item only.
+# Requests linked through depends_on are always packed into the same envelope, as Graph requires.
+
+class GraphBatch:
+    def __init__(self, graph_client, max_concurrency: int = 4):
+        self.graph_client = graph_client
+        self.max_concurrency = max_concurrency
+        self.requests = {}
+        self.futures = {}
+
+    # Queue a request. url is relative to the API version, e.g. /groups/{id}/members/$ref
+
+    def add(self, method: str, url: str, body=None, headers=None, request_id=None, depends_on=None):
+        request_id = str(request_id or len(self.requests) + 1)
+        if request_id in self.requests:
+            raise ValueError(f"Duplicate batch request id {request_id}")
+        request = {"id": request_id, "method": method.upper(), "url": url}
+        if body is not None:
+            request["body"] = body
+            headers = {"Content-Type": "application/json", **(headers or {})}
+        if headers:
+            request["headers"] = headers
+        if depends_on:
+            depends_on = [str(value) for value in depends_on]
+            for dependency in depends_on:
+                if dependency not in self.requests:
+                    raise ValueError(f"Batch request {request_id} depends on unknown request {dependency}")
+            request["dependsOn"] = depends_on
+        self.requests[request_id] = request
+        future = asyncio.get_running_loop().create_future()
+        self.futures[request_id] = future
+        return future
+
+    # Group the queued requests into dependsOn chains (requests without dependencies are chains of one)
+
+    def components(self):
+        parent = {request_id: request_id for request_id in self.requests}
+
+        def find(request_id):
+            while parent[request_id] != request_id:
+                parent[request_id] = parent[parent[request_id]]
+                request_id = parent[request_id]
+            return request_id
+
+        for request_id, request in self.requests.items():
+            for dependency in request.get("dependsOn", []):
+                parent[find(request_id)] = find(dependency)
+
+        components = {}
+        for request_id, request in self.requests.items():
+            components.setdefault(find(request_id), []).append(request)
+        for component in components.values():
+            if len(component) > MAX_BATCH_SIZE:
+                raise ValueError(f"A dependsOn chain of {len(component)} requests does not fit in one batch")
+        return list(components.values())
+
+    # Pack chains into envelopes of at most 20 requests, keeping the original order otherwise
+
+    def envelopes(self, components: list = None):
+        if components is None:
+            components = self.components()
+        envelopes = []
+        current = []
+        size = 0  # Requests in current, which holds whole chains
+        for component in components:
+            if size + len(component) > MAX_BATCH_SIZE:
+                envelopes.append(current)
+                current = []
+                size = 0
+            current.append(component)
+            size += len(component)
+        if current:
+            envelopes.append(current)
+        return envelopes
+
+    async def _send_envelope(self, requests: list):
+        result = await self.graph_client.send_json("POST", "/$batch", {"requests": requests})
+        return result["responses"]
+
+    def _resolve(self, component: list, by_id: dict, futures: dict):
+        for request in component:
+            future = futures[request["id"]]
+            if future.done():
+                continue
+            response = by_id.get(request["id"])
+            if response is None:
+                future.set_exception(BatchItemError(request["id"], None, None))
+            elif response["status"] >= 400:
+                future.set_exception(BatchItemError(request["id"], response["status"], response.get("body")))
+            else:
+                future.set_result(response.get("body"))
+
+    # Requests of a chain to send again: the throttled ones and those that failed with 424 because a request
+    # they depend on was throttled. dependsOn entries pointing at requests that already succeeded are dropped
+
+    @staticmethod
+    def _retry_part(component: list, by_id: dict):
+        retry = {request["id"] for request in component
+                 if by_id.get(request["id"], {}).get("status") in RETRY_STATUSES}
+        changed = True
+        while changed:
+            changed = False
+            for request in component:
+                if request["id"] in retry or by_id.get(request["id"], {}).get("status") != 424:
+                    continue
+                if any(dependency in retry for dependency in request.get("dependsOn", [])):
+                    retry.add(request["id"])
+                    changed = True
+        resend = []
+        for request in component:
+            if request["id"] not in retry:
+                continue
+            request = dict(request)
+            depends_on = [dependency for dependency in request.pop("dependsOn", []) if dependency in retry]
+            if depends_on:
+                request["dependsOn"] = depends_on
+            resend.append(request)
+        return resend
+
+    # Send every queued request. Envelopes are sent concurrently, bounded by max_concurrency.
+    # Sub-requests throttled by Graph (429/503/504) are resent after Retry-After, up to max_retries times,
+    # together with the requests of their dependsOn chain that failed because of them (424). Requests that
+    # succeeded are resolved and never sent twice; the envelope itself is retried by the client's transport.
+
+    async def execute(self, max_retries: int = 5):
+        components = self.components()
+        futures = self.futures
+        self.requests = {}
+        self.futures = {}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        attempt = 0
+
+        async def run(envelope):
+            async with semaphore:
+                requests = [request for component in envelope for request in component]
+                try:
+                    responses = await self._send_envelope(requests)
+                except Exception as error:
+                    for request in requests:
+                        if not futures[request["id"]].done():
+                            futures[request["id"]].set_exception(error)
+                    return [], 0.0
+            by_id = {response["id"]: response for response in responses}
+            throttled = []
+            delay = 0.0
+            for component in envelope:
+                statuses = [by_id.get(request["id"], {}).get("status") for request in component]
+                throttled_responses = [by_id[request["id"]] for request, status in zip(component, statuses)
+                                       if status in RETRY_STATUSES]
+                if throttled_responses and attempt < max_retries:
+                    resend = self._retry_part(component, by_id)
+                    resent = {request["id"] for request in resend}
+                    self._resolve([request for request in component if request["id"] not in resent], by_id, futures)
+                    throttled.append(resend)
+                    for response in throttled_responses:
+                        delay = max(delay, retry_delay(response.get("headers"), attempt))
+                else:
+                    self._resolve(component, by_id, futures)
+            return throttled, delay
+
+        while components:
+            results = await asyncio.gather(*(run(envelope) for envelope in self.envelopes(components)))
+            components = [component for throttled, _ in results for component in throttled]
+            if components:
+                await asyncio.sleep(max(delay for _, delay in results))
+                attempt += 1
+
+
+# Send one request per distinct item through a batch and map each item to None (success) or the exception raised for it
+
+async def batch_each(graph_client, items: list, build_request):
+    batch = GraphBatch(graph_client)
+    futures = {}
+    for item in dict.fromkeys(items):  # A repeated item is sent once, its result is shared
+        method, url, body = build_request(item)
+        futures[item] = batch.add(method, url, body)
+    await batch.execute()
+    results = await asyncio.gather(*futures.values(), return_exceptions=True)
+    return {item: (result if isinstance(result, Exception) else None) for item, result in zip(futures, results)}
+
+
+# GET the first page of every url through $batch and follow @odata.nextLink for the rest.
+# urls maps any key to a collection url; returns {key: list of values, or the exception raised for that key}
+
+async def batch_get_all(graph_client, urls: dict, max_concurrency: int = 4):
+    batch = GraphBatch(graph_client, max_concurrency)
+    futures = {key: batch.add("GET", url) for key, url in urls.items()}
+    await batch.execute()
+    results = {}
+    remaining = {}
+    for key, future in futures.items():
+        try:
+            page = future.result() or {}
+        except Exception as error:
+            results[key] = error
+            continue
+        results[key] = page.get("value", [])
+        if page.get("@odata.nextLink"):
+            remaining[key] = page["@odata.nextLink"]
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def follow(key, next_link):
+        async with semaphore:
+            try:
+                async for page in iterate_raw_pages(graph_client, next_link):
+                    results[key].extend(page.get("value", []))
+            except Exception as error:
+                results[key] = error
+
+    await asyncio.gather(*(follow(key, next_link) for key, next_link in remaining.items()))
+    return results
@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from client import GraphClient
+from groups import Groups
+from mock_graph import MockGraph, MockGraphTransport, StaticTokenCredential, mock_settings
+from tenant import Tenant
+from users import Users
+
+EXTENSION_NAMES = ['Domicile', 'Cost Center', 'Employee Number']
+
+
+def percentile(samples: list, fraction: float):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+# Everything a scenario needs: a seeded mock directory and Users/Groups/Tenant sharing one client on top of it
+
+class Environment:
+    def __init__(self, args):
+        self.args = args
+        self.graph = MockGraph().seed(args.users, args.groups, args.members, EXTENSION_NAMES)
+        self.settings = mock_settings()
+        transport = MockGraphTransport(self.graph, latency=args.latency, jitter=args.jitter,
+                                       throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+        self.graph_client = GraphClient(self.settings, transport=transport, credential=StaticTokenCredential())
+        self.users = Users(self.settings, self.graph_client)
+        self.groups = Groups(self.settings, self.graph_client)
+        self.tenant = Tenant(self.settings, self.graph_client)
+        self.runs = 0
+
+    async def close(self):
+        await self.graph_client.close()
+
+
+# Scenarios return (operations, latencies of the individual operations in seconds)
+
+async def full_scan(env: Environment):
+    latencies = []
+    count = 0
+    started = time.perf_counter()
+    async for _ in env.users.iter_all_users(page_size=env.args.page_size):
+        count += 1
+        if count % env.args.page_size == 0:
+            latencies.append(time.perf_counter() - started)
+            started = time.perf_counter()
+    return count, latencies
+
+
+# Same scan in lightweight mode (UserRecord parsed from the streamed body, no Kiota models)
+
+async def light_scan(env: Environment):
+    latencies = []
+    count = 0
+    started = time.perf_counter()
+    async for _ in env.users.iter_all_users(page_size=env.args.page_size, lightweight=True):
+        count += 1
+        if count % env.args.page_size == 0:
+            latencies.append(time.perf_counter() - started)
+            started = time.perf_counter()
+    return count, latencies
+
+
+async def bulk_create(env: Environment):
+    semaphore = asyncio.Semaphore(env.args.concurrency)
+    latencies = []
+
+    async def create(index):
+        async with semaphore:
+            started = time.perf_counter()
+            await env.users.user_creation_singular({"Name": f"Bench {env.runs} {index}"}, {"Domicile": "Bench"})
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(create(index) for index in range(env.args.creates)))
+    return env.args.creates, latencies
+
+
+async def bulk_membership(env: Environment):
+    user_ids = list(env.graph.users)
+    group = env.graph.create_group({"displayName": f"Bench group {env.runs}"})
+    latencies = []
+    chunk = env.args.membership_chunk
+    for start in range(0, min(env.args.adds, len(user_ids)), chunk):
+        started = time.perf_counter()
+        await env.groups.add_users_to_group(user_ids[start:start + chunk], group["id"])
+        latencies.append(time.perf_counter() - started)
+    return min(env.args.adds, len(user_ids)), latencies
+
+
+async def schema_lookups(env: Environment):
+    user_ids = random.Random(env.runs).sample(list(env.graph.users), min(env.args.lookups, len(env.graph.users)))
+    semaphore = asyncio.Semaphore(env.args.concurrency)
+    latencies = []
+
+    async def lookup(user_id):
+        async with semaphore:
+            started = time.perf_counter()
+            await env.users.get_user_by_id(user_id)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(lookup(user_id) for user_id in user_ids))
+    return len(user_ids), latencies
+
+
+SCENARIOS = {
+    'full_scan': full_scan,
+    'light_scan': light_scan,
+    'bulk_create': bulk_create,
+    'bulk_membership': bulk_membership,
+    'schema_lookups': schema_lookups,
+}
+
+
+async def measure(env: Environment, name: str, memory: bool):
+    env.runs += 1
+    requests = env.graph.requests
+    sub_requests = env.graph.sub_requests
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    operations, latencies = await SCENARIOS[name](env)
+    seconds = time.perf_counter() - started
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        "scenario": name,
+        "operations": operations,
+        "requests": env.graph.requests - requests,
+        "batched": env.graph.sub_requests - sub_requests,
+        "seconds": round(seconds, 4),
+        "throughput": round(operations / seconds, 1) if seconds else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "peak_mib": round(peak / 2 ** 20, 2) if peak is not None else None,
+    }
+
+
+# Timing and memory are measured in separate runs, tracemalloc slows allocation-heavy code down considerably
+
+async def run(args):
+    env = Environment(args)
+    results = []
+    try:
+        for name in args.scenarios:
+            result = await measure(env, name, memory=False)
+            if args.memory:
+                result["peak_mib"] = (await measure(env, name, memory=True))["peak_mib"]
+            results.append(result)
+        if args.report:
+            print(env.graph_client.instrumentation.report(), end="\n\n")
+    finally:
+        await env.close()
+    return results
+
+
+def report(results: list):
+    columns = ["scenario", "operations", "requests", "batched", "seconds", "throughput", "p50_ms", "p99_ms", "peak_mib"]
+    rows = [[str(result[column]) for column in columns] for result in results]
+    widths = [max(len(column), *(len(row[index]) for row in rows)) for index, column in enumerate(columns)]
+    lines = ["  ".join(column.ljust(width) for column, width in zip(columns, widths))]
+    lines += ["  ".join(value.ljust(width) for value, width in zip(row, widths)) for row in rows]
+    return "\n".join(lines)
+
+
+IMPORT_MODULES = ['users', 'groups', 'tenant']
+# Packages a cold import of IMPORT_MODULES must not load, they are imported on first use
+LAZY_PACKAGES = {'msgraph', 'msgraph_core', 'kiota_abstractions', 'kiota_authentication_azure', 'kiota_http', 'azure'}
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+for name in sys.argv[1].split(','):
+    __import__(name)
+print(json.dumps({"ms": (time.perf_counter() - started) * 1000, "modules": list(sys.modules)}))
+"""
+
+
+# Cold import time of users, groups and tenant, each run in a fresh interpreter.
+# ok is False when the median is over max_ms or when any run loaded one of LAZY_PACKAGES
+
+def import_time(runs: int = 5, max_ms: float = None, modules: list = IMPORT_MODULES):
+    samples = []
+    eager = set()
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', IMPORT_PROBE, ','.join(modules)], capture_output=True,
+                                text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        probe = json.loads(output.stdout)
+        samples.append(probe["ms"])
+        eager.update(name for name in probe["modules"] if name.split('.')[0] in LAZY_PACKAGES)
+    median = statistics.median(samples)
+    return {
+        "modules": modules,
+        "runs": runs,
+        "median_ms": round(median, 2),
+        "max_ms": max_ms,
+        "eager_modules": sorted(eager),
+        "ok": not eager and (max_ms is None or median <= max_ms),
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark Users, Groups and Tenant against the local mock Graph")
+    parser.add_argument('--scenarios', type=lambda value: value.split(','), default=list(SCENARIOS))
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--members', type=int, default=50)
+    parser.add_argument('--page-size', type=int, default=999)
+    parser.add_argument('--creates', type=int, default=1000)
+    parser.add_argument('--adds', type=int, default=5000)
+    parser.add_argument('--membership-chunk', type=int, default=500)
+    parser.add_argument('--lookups', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every mock response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random extra latency, up to this many seconds")
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument('--retry-after', type=float, default=0.1)
+    parser.add_argument('--memory', action='store_true', help="Also measure peak memory (tracemalloc)")
+    parser.add_argument('--report', action='store_true', help="Print the per endpoint instrumentation report")
+    parser.add_argument('--json', help="Write the results to this file")
+    parser.add_argument('--import-time', action='store_true',
+                        help="Only measure the cold import of users, groups and tenant (Exits with 1 on a regression)")
+    parser.add_argument('--import-runs', type=int, default=5)
+    parser.add_argument('--max-import-ms', type=float, help="Fail when the median import time is above this")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.import_time:
+        result = import_time(args.import_runs, args.max_import_ms)
+        print(json.dumps(result, indent=2))
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as file:
+                json.dump(result, file, indent=2)
+        if not result["ok"]:
+            raise SystemExit(1)
+        return
+    results = asyncio.run(run(args))
+    print(report(results))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
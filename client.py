@@ -0,0 +1,212 @@
+from __future__ import annotations
+import asyncio
+import time
+from configparser import SectionProxy
+from typing import TYPE_CHECKING
+import httpx
+from coalescing import PatchCoalescer
+from instrumentation import Instrumentation, InstrumentedTransport
+from schema import ExtensionSchemaRegistry
+from throttling import ThrottlingTransport, forget_throttle_controllers, get_throttle_controller
+
+if TYPE_CHECKING:
+    from azure.identity.aio import ClientSecretCredential
+    from msgraph import GraphRequestAdapter, GraphServiceClient
+
+GRAPH_URL = 'https://graph.microsoft.com/v1.0'
+GRAPH_SCOPE = 'https://graph.microsoft.com/.default'
+
+
+# Keeps one access token per scope set in memory.
+# A token that is about to expire (within refresh_margin seconds) is still returned while a single
+# background refresh runs, so callers only wait for the identity endpoint on a cold start.
+
+class CachedTokenCredential:
+    def __init__(self, credential, refresh_margin: int = 300):
+        self.credential = credential
+        self.refresh_margin = refresh_margin
+        self.tokens = {}
+        self.refreshing = {}
+        self.lock = asyncio.Lock()
+
+    async def _fetch(self, scopes: tuple, **kwargs):
+        token = await self.credential.get_token(*scopes, **kwargs)
+        self.tokens[scopes] = token
+        return token
+
+    def _refresh_in_background(self, scopes: tuple):
+        task = self.refreshing.get(scopes)
+        if task is None or task.done():
+            self.refreshing[scopes] = asyncio.ensure_future(self._fetch(scopes))
+
+    async def get_token(self, *scopes, **kwargs):
+        if kwargs.get('claims'):
+            # Claims challenges need a fresh token, never a cached one
+            return await self._fetch(scopes, **kwargs)
+        token = self.tokens.get(scopes)
+        if token is not None:
+            remaining = token.expires_on - time.time()
+            if remaining > self.refresh_margin:
+                return token
+            if remaining > 30:
+                self._refresh_in_background(scopes)
+                return token
+        async with self.lock:
+            token = self.tokens.get(scopes)
+            if token is not None and token.expires_on - time.time() > 30:
+                return token
+            return await self._fetch(scopes)
+
+    async def close(self):
+        for task in self.refreshing.values():
+            task.cancel()
+        await self.credential.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+# One credential, token cache, keep-alive HTTP/2 connection pool and GraphServiceClient per tenant and client id.
+# Optional [azure] settings: http2, maxConnections, maxKeepaliveConnections, keepaliveExpiry, timeout, tokenRefreshMargin,
+# schemaTtl (seconds the extension property schema is cached), patchWindow (seconds updates of one object are
+# collected into one PATCH), maxRetries and the rate settings read by throttling.get_throttle_controller
+# The Kiota request adapter and GraphServiceClient are built on first use, the raw JSON paths (send_json, $batch,
+# records, queries, exports) never import the generated msgraph package
+
+class GraphClient:
+    settings: SectionProxy
+    client_credential: ClientSecretCredential
+
+    def __init__(self, config: SectionProxy, transport: httpx.AsyncBaseTransport = None, credential=None,
+                 instrumentation: Instrumentation = None):
+        self.settings = config
+        self.key = client_key(config)
+        tenant_id, client_id = self.key
+        client_secret = self.settings['clientSecret']
+        if credential is None:
+            from azure.identity.aio import ClientSecretCredential
+            credential = ClientSecretCredential(tenant_id, client_id, client_secret)
+        self.client_credential = credential
+        self.token_cache = CachedTokenCredential(self.client_credential,
+                                                 config.getint('tokenRefreshMargin', fallback=300))
+        if transport is None:
+            limits = httpx.Limits(
+                max_connections=config.getint('maxConnections', fallback=100),
+                max_keepalive_connections=config.getint('maxKeepaliveConnections', fallback=20),
+                keepalive_expiry=config.getfloat('keepaliveExpiry', fallback=30.0),
+            )
+            transport = httpx.AsyncHTTPTransport(http2=config.getboolean('http2', fallback=True), limits=limits)
+        # Rate, concurrency and 429 handling are shared by every client of the tenant
+        transport = ThrottlingTransport(transport, lambda: get_throttle_controller(tenant_id, config),
+                                        max_retries=config.getint('maxRetries', fallback=5))
+        # Per call latency, retries, throttle waits, payload sizes and parse time, see instrumentation.py
+        self.instrumentation = instrumentation or Instrumentation()
+        transport = InstrumentedTransport(transport, self.instrumentation)
+        self.transport = transport
+        http_client = httpx.AsyncClient(transport=transport, timeout=config.getfloat('timeout', fallback=60.0))
+        from kiota_http.middleware import RetryHandler
+        from msgraph_core import GraphClientFactory
+        from msgraph_core.middleware import GraphTelemetryHandler
+        # The default kiota pipeline without its RetryHandler: ThrottlingTransport below it already retries
+        # 429/503/504 with the tenant's backoff, a second retry loop on top would multiply the attempts
+        middleware = [handler for handler in GraphClientFactory.get_default_middleware(None)
+                      if not isinstance(handler, RetryHandler)]
+        middleware.append(GraphTelemetryHandler())
+        self.http_client = GraphClientFactory.create_with_custom_middleware(middleware, client=http_client)
+        self._request_adapter = None
+        self._app_client = None
+        self.extension_schemas = ExtensionSchemaRegistry(self, config.getfloat('schemaTtl', fallback=300))
+        self.patches = PatchCoalescer(self, config.getfloat('patchWindow', fallback=0.01))
+        self.closed = False
+
+    # Kiota request adapter and GraphServiceClient for the typed request builders, created on first access
+
+    @property
+    def request_adapter(self) -> GraphRequestAdapter:
+        if self._request_adapter is None:
+            from kiota_authentication_azure.azure_identity_authentication_provider import (
+                AzureIdentityAuthenticationProvider
+            )
+            from msgraph import GraphRequestAdapter
+            auth_provider = AzureIdentityAuthenticationProvider(self.token_cache)  # type: ignore
+            self._request_adapter = GraphRequestAdapter(auth_provider, client=self.http_client)
+            self.instrumentation.instrument_adapter(self._request_adapter)
+        return self._request_adapter
+
+    @property
+    def app_client(self) -> GraphServiceClient:
+        if self._app_client is None:
+            from msgraph import GraphServiceClient
+            self._app_client = GraphServiceClient(self.request_adapter)
+        return self._app_client
+
+    # Send a raw request (url relative to /v1.0 or absolute) through the shared pool with a cached token.
+    # With stream=True the body is left unread, the caller reads it with aiter_bytes/aiter_text and closes the response
+
+    async def send(self, method: str, url: str, json_body=None, headers=None, stream: bool = False) -> httpx.Response:
+        token = await self.token_cache.get_token(GRAPH_SCOPE)
+        request_headers = {'Authorization': f"Bearer {token.token}", 'Accept': 'application/json'}
+        request_headers.update(headers or {})
+        if not url.startswith('https://'):
+            url = GRAPH_URL + url
+        request = self.http_client.build_request(method, url, json=json_body, headers=request_headers)
+        request.options = {}  # Read by the kiota middleware handlers
+        return await self.http_client.send(request, stream=stream)
+
+    async def send_json(self, method: str, url: str, json_body=None, headers=None):
+        async with self.instrumentation.measure():
+            response = await self.send(method, url, json_body, headers)
+            response.raise_for_status()
+            if response.status_code == 204 or not response.content:
+                return None
+            return response.json()
+
+    # Controller of the tenant on the running event loop
+
+    @property
+    def throttle(self):
+        return get_throttle_controller(self.key[0], self.settings)
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if _clients.get(self.key) is self:
+            del _clients[self.key]
+        await self.patches.close()
+        await self.http_client.aclose()
+        await self.token_cache.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+_clients = {}
+
+
+def client_key(config: SectionProxy):
+    return config['tenantId'].strip(), config['clientId'].strip()
+
+
+# Get the shared client for the tenant and client id in config, creating it on first use
+
+def get_graph_client(config: SectionProxy) -> GraphClient:
+    client = _clients.get(client_key(config))
+    if client is None or client.closed:
+        client = GraphClient(config)
+        _clients[client.key] = client
+    return client
+
+
+# Close every shared client (Call once at shutdown)
+
+async def close_all_clients():
+    for client in list(_clients.values()):
+        await client.close()
+    forget_throttle_controllers()
@@ -0,0 +1,100 @@
+import asyncio
+from batching import GraphBatch, MAX_BATCH_SIZE
+
+
+# Buffers PATCH bodies per object for `window` seconds (or until flush()) and sends one merged PATCH per object.
+# Updates of different objects that fall in the same window share $batch envelopes.
+# Every caller awaits the result of the merged request, so an error reaches everyone whose update it carried.
+# A property written twice in one window keeps the last value.
+# An object is never in two flushes at once: updates arriving while its PATCH is in flight (possibly being retried
+# after a 429) wait and go out in the next flush, so an older value cannot land after a newer one.
+
+class PatchCoalescer:
+    def __init__(self, graph_client, window: float = 0.01, max_concurrency: int = 4):
+        self.graph_client = graph_client
+        self.window = window
+        self.max_concurrency = max_concurrency
+        self.pending = {}
+        self.timer = None
+        self.flushes = set()
+        self.in_flight = set()
+
+    # Queue properties (raw Graph names, extension_... for directory extensions) for /{resource}/{object_id}.
+    # Returns a future that resolves once the merged PATCH has been sent
+
+    def update(self, resource: str, object_id: str, properties: dict):
+        loop = asyncio.get_running_loop()
+        entry = self.pending.get((resource, object_id))
+        if entry is None:
+            entry = {"body": {}, "futures": []}
+            self.pending[(resource, object_id)] = entry
+        entry["body"].update(properties)
+        future = loop.create_future()
+        entry["futures"].append(future)
+        if len(self.pending) >= MAX_BATCH_SIZE * self.max_concurrency:
+            self._start_flush()  # Enough for full envelopes, waiting longer only adds latency
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self._start_flush)
+        return future
+
+    def _start_flush(self):
+        task = asyncio.ensure_future(self.flush())
+        self.flushes.add(task)
+        task.add_done_callback(self.flushes.discard)
+
+    # Send everything buffered so far
+
+    async def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        pending, self.pending = self.pending, {}
+        for key in [key for key in pending if key in self.in_flight]:
+            self._hold(key, pending.pop(key))
+        if not pending:
+            return
+        self.in_flight.update(pending)
+        try:
+            await self._send(pending)
+        finally:
+            self.in_flight.difference_update(pending)
+            if any(key in self.pending for key in pending):
+                self._start_flush()  # Updates held back while these PATCHes were in flight
+
+    # Put an entry back in front of updates queued since, its body is the older one
+
+    def _hold(self, key, entry):
+        newer = self.pending.get(key)
+        if newer is not None:
+            entry["body"].update(newer["body"])
+            entry["futures"].extend(newer["futures"])
+        self.pending[key] = entry
+
+    async def _send(self, pending: dict):
+        batch = GraphBatch(self.graph_client, self.max_concurrency)
+        requests = [(batch.add("PATCH", f"/{resource}/{object_id}", entry["body"]), entry)
+                    for (resource, object_id), entry in pending.items()]
+        try:
+            await batch.execute()
+        except Exception as error:
+            for _, entry in requests:
+                for future in entry["futures"]:
+                    if not future.done():
+                        future.set_exception(error)
+            return
+        for request, entry in requests:
+            error = request.exception()
+            for future in entry["futures"]:
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(None)
+
+    # Flush and wait for flushes already in flight
+
+    async def close(self):
+        await self.flush()
+        while self.flushes:
+            await asyncio.gather(*self.flushes, return_exceptions=True)
@@ -0,0 +1,17 @@
+import configparser
+import functools
+
+CONFIG_FILES = ('config.cfg', 'config.dev.cfg')
+
+
+# Read the config files once per process. Later calls (and every module asking for the same files) get the cached parser
+
+@functools.lru_cache(maxsize=None)
+def load_config(paths: tuple = CONFIG_FILES):
+    config = configparser.ConfigParser()
+    config.read(paths)
+    return config
+
+
+def load_settings(section: str = 'azure', paths: tuple = CONFIG_FILES):
+    return load_config(tuple(paths))[section]
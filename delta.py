@@ -0,0 +1,189 @@
+import sqlite3
+import time
+import httpx
+from paging import iterate_raw_pages
+
+# Properties requested from /users/delta and /groups/delta unless the caller passes its own select.
+# "members" makes /groups/delta report member additions and removals in members@delta.
+USER_SELECT = ['displayName', 'id', 'jobTitle', 'userPrincipalName', 'mail']
+GROUP_SELECT = ['displayName', 'id', 'description', 'members']
+
+# Error codes Graph returns (with 400 or 410) when a delta token can no longer be used
+EXPIRED_TOKEN_CODES = {'syncStateNotFound', 'resyncRequired', 'SyncStateNotFound', 'SyncStateInvalid'}
+
+
+# Durable store for delta links and for the ids already seen per resource (users / groups).
+# The known ids tell an added object apart from an updated one, which /delta itself does not.
+# Pass an open connection to commit the delta link in the same transaction as the caller's own writes.
+
+class DeltaStore:
+    def __init__(self, path: str = 'delta.sqlite3', connection: sqlite3.Connection = None):
+        self.connection = connection or sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS delta_links (
+                resource TEXT PRIMARY KEY,
+                link TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS known_objects (
+                resource TEXT NOT NULL,
+                id TEXT NOT NULL,
+                PRIMARY KEY (resource, id)
+            ) WITHOUT ROWID;
+        """)
+
+    def get_link(self, resource: str):
+        row = self.connection.execute("SELECT link FROM delta_links WHERE resource = ?", (resource,)).fetchone()
+        return row[0] if row else None
+
+    def set_link(self, resource: str, link: str):
+        self.connection.execute("INSERT OR REPLACE INTO delta_links VALUES (?, ?, ?)", (resource, link, time.time()))
+
+    def clear_link(self, resource: str):
+        self.connection.execute("DELETE FROM delta_links WHERE resource = ?", (resource,))
+        self.connection.commit()
+
+    def is_known(self, resource: str, object_id: str):
+        row = self.connection.execute("SELECT 1 FROM known_objects WHERE resource = ? AND id = ?",
+                                      (resource, object_id)).fetchone()
+        return row is not None
+
+    def mark_known(self, resource: str, object_id: str):
+        self.connection.execute("INSERT OR IGNORE INTO known_objects VALUES (?, ?)", (resource, object_id))
+
+    def forget(self, resource: str, object_id: str):
+        self.connection.execute("DELETE FROM known_objects WHERE resource = ? AND id = ?", (resource, object_id))
+
+    def known_ids(self, resource: str):
+        cursor = self.connection.execute("SELECT id FROM known_objects WHERE resource = ?", (resource,))
+        return [row[0] for row in cursor]
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+
+def token_expired(error: httpx.HTTPStatusError):
+    if error.response.status_code == 410:
+        return True
+    if error.response.status_code != 400:
+        return False
+    try:
+        code = error.response.json().get('error', {}).get('code')
+    except ValueError:
+        return False
+    return code in EXPIRED_TOKEN_CODES
+
+
+# Incremental sync of users and groups through /users/delta and /groups/delta.
+# Every round resumes from the stored delta link and yields one event per change:
+#   {"resource": "users", "change": "added" | "updated" | "removed", "id": ..., "data": {...}, "full": bool}
+#   {"resource": "groups", "change": "member_added" | "member_removed", "id": group id, "member_id": ..., "member_type": ...}
+# The new delta link and the known ids are committed together after the last page, so an interrupted round
+# is replayed from the previous link. When the link has expired a full resync runs and objects that were
+# known but are no longer returned are reported as removed.
+# "full" is true when the event comes from a full read, its member events then list every current member.
+
+class DeltaSync:
+    def __init__(self, graph_client, store: DeltaStore, user_select: list = None, group_select: list = None):
+        self.graph_client = graph_client
+        self.store = store
+        self.select = {
+            'users': user_select or USER_SELECT,
+            'groups': group_select or GROUP_SELECT,
+        }
+        self.reading = None
+
+    def initial_url(self, resource: str):
+        return f"/{resource}/delta?$select={','.join(self.select[resource])}"
+
+    async def changes(self, resource: str):
+        link = self.store.get_link(resource)
+        if link is not None:
+            events = self._read(resource, link, resync=False)
+            try:
+                async for event in events:
+                    yield event
+                return
+            except httpx.HTTPStatusError as error:
+                if not token_expired(error):
+                    raise
+                self.store.clear_link(resource)
+            finally:
+                await events.aclose()  # Rolls back now when the consumer stops early, not when _read is collected
+        events = self._read(resource, self.initial_url(resource), resync=True)
+        try:
+            async for event in events:
+                yield event
+        finally:
+            await events.aclose()
+
+    # Any way out before the final commit (errors, cancellation, the consumer closing the generator) rolls back
+    # the known ids written so far, they are only valid together with the delta link of the same round.
+    # A generator dropped without aclose() is finalized later: the next round discards its writes when it starts,
+    # and the late rollback is skipped because that round now owns the transaction
+
+    async def _read(self, resource: str, url: str, resync: bool):
+        if self.reading is not None:
+            self.store.rollback()
+        self.reading = read = object()
+        try:
+            seen = set() if resync else None
+            delta_link = None
+            async for page in iterate_raw_pages(self.graph_client, url):
+                for value in page.get('value', []):
+                    object_id = value['id']
+                    members = value.pop('members@delta', None)
+                    if '@removed' in value:
+                        change = 'removed'
+                        self.store.forget(resource, object_id)
+                    else:
+                        change = 'updated' if self.store.is_known(resource, object_id) else 'added'
+                        self.store.mark_known(resource, object_id)
+                        if seen is not None:
+                            seen.add(object_id)
+                    yield {"resource": resource, "change": change, "id": object_id, "data": value, "full": resync}
+                    for member in members or []:
+                        yield {
+                            "resource": resource,
+                            "change": 'member_removed' if '@removed' in member else 'member_added',
+                            "id": object_id,
+                            "member_id": member['id'],
+                            "member_type": member.get('@odata.type'),
+                        }
+                delta_link = page.get('@odata.deltaLink', delta_link)
+            if seen is not None:
+                for object_id in self.store.known_ids(resource):
+                    if object_id not in seen:
+                        self.store.forget(resource, object_id)
+                        yield {"resource": resource, "change": 'removed', "id": object_id, "data": None, "full": True}
+            if delta_link is not None:
+                self.store.set_link(resource, delta_link)
+            self.store.commit()
+            self.reading = None
+        except BaseException:
+            if self.reading is read:
+                self.reading = None
+                self.store.rollback()
+            raise
+
+    async def sync_users(self):
+        async for event in self.changes('users'):
+            yield event
+
+    async def sync_groups(self):
+        async for event in self.changes('groups'):
+            yield event
+
+    # Users first, then groups (with member changes)
+
+    async def sync(self):
+        async for event in self.sync_users():
+            yield event
+        async for event in self.sync_groups():
+            yield event
@@ -0,0 +1,240 @@
+import gzip
+import json
+import os
+from batching import BatchItemError, GraphBatch
+from paging import iterate_raw_pages
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Only needed for format='parquet'
+    pyarrow = None
+
+DATASETS = ('users', 'groups', 'memberships')
+USER_COLUMNS = ['id', 'displayName', 'userPrincipalName', 'mail', 'jobTitle']
+GROUP_COLUMNS = ['id', 'displayName', 'description', 'mail']
+MEMBERSHIP_COLUMNS = ['group_id', 'member_id', 'member_type']
+CURSOR_FILE = 'cursor.json'
+
+
+def _write_json(path: str, value):
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(value, file, indent=2)
+    os.replace(temporary, path)
+
+
+class JsonlPart:
+    def __init__(self, path: str, columns: list, compression: str = None):
+        self.file = gzip.open(path, 'wt', encoding='utf-8') if compression == 'gzip' else open(path, 'w', encoding='utf-8')
+
+    def write(self, rows: list):
+        self.file.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+# Every page becomes one row group. Values are written as strings (JSON for lists and numbers),
+# so all parts of a dataset share one schema whatever the extension values look like.
+
+class ParquetPart:
+    def __init__(self, path: str, columns: list, compression: str = None):
+        self.columns = columns
+        self.schema = pyarrow.schema([(column, pyarrow.string()) for column in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression=compression or 'none')
+
+    @staticmethod
+    def _text(value):
+        if value is None or isinstance(value, str):
+            return value
+        return json.dumps(value)
+
+    def write(self, rows: list):
+        columns = {column: [self._text(row.get(column)) for row in rows] for column in self.columns}
+        self.writer.write_table(pyarrow.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+FORMATS = {
+    'jsonl': JsonlPart,
+    'parquet': ParquetPart,
+}
+
+
+# Streams users, groups and memberships (group_id, member_id, member_type) to part files:
+#   <directory>/<dataset>/part-00000.jsonl[.gz] or .parquet
+# Directory extension values become columns named by their readable name.
+# Only one page is held in memory at a time. A part is closed once it holds rows_per_part rows, at a page
+# boundary, and renamed into place; cursor.json then records the part count and the link of the next page.
+# An interrupted export continues from the cursor when run again; parts written after the last cursor
+# update are removed first, so no row is exported twice.
+
+class DirectoryExporter:
+    def __init__(self, graph_client, directory: str, format: str = 'jsonl', compression: str = None,
+                 rows_per_part: int = 100000, page_size: int = 999, group_page_size: int = 20):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown export format {format!r}, expected one of {', '.join(FORMATS)}")
+        if format == 'parquet' and pyarrow is None:
+            raise ImportError("Parquet export needs pyarrow (pip install pyarrow)")
+        self.graph_client = graph_client
+        self.settings = graph_client.settings
+        self.directory = directory
+        self.format = format
+        self.compression = compression
+        self.rows_per_part = rows_per_part
+        self.page_size = page_size
+        self.group_page_size = group_page_size  # Groups whose members are exported between two cursor updates
+        self.cursor = None
+
+    @property
+    def suffix(self):
+        if self.format == 'parquet':
+            return '.parquet'
+        return '.jsonl.gz' if self.compression == 'gzip' else '.jsonl'
+
+    def _load_cursor(self, restart: bool):
+        path = os.path.join(self.directory, CURSOR_FILE)
+        cursor = None
+        if not restart and os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                cursor = json.load(file)
+            if (cursor.get('format'), cursor.get('compression')) != (self.format, self.compression):
+                raise ValueError(f"{self.directory} holds a {cursor.get('format')} export with compression "
+                                 f"{cursor.get('compression')}, pass restart=True to start over")
+        if cursor is None:
+            cursor = {"format": self.format, "compression": self.compression, "datasets": {}}
+        self.cursor = cursor
+
+    def _save_cursor(self):
+        _write_json(os.path.join(self.directory, CURSOR_FILE), self.cursor)
+
+    def _part_path(self, dataset: str, index: int):
+        return os.path.join(self.directory, dataset, f"part-{index:05d}{self.suffix}")
+
+    def _remove_uncommitted(self, dataset: str, parts: int):
+        folder = os.path.join(self.directory, dataset)
+        os.makedirs(folder, exist_ok=True)
+        for name in os.listdir(folder):
+            if not name.startswith('part-'):
+                continue
+            if name.endswith('.tmp') or int(name[5:10]) >= parts:
+                os.remove(os.path.join(folder, name))
+
+    # Pages of one dataset as (rows, next_link, boundary). next_link is where a resumed export continues,
+    # rows yielded with boundary=False cannot be followed by a cursor update
+
+    async def _object_pages(self, url: str, columns: list, extensions: dict):
+        async for page in iterate_raw_pages(self.graph_client, url):
+            rows = []
+            for value in page.get('value', []):
+                row = {column: value.get(column) for column in columns}
+                for raw_name, readable in extensions.items():
+                    row[readable] = value.get(raw_name)
+                rows.append(row)
+            yield rows, page.get('@odata.nextLink'), True
+
+    # Members of every group, group_page_size groups at a time. The first member page of those groups is read
+    # through $batch, larger groups are paged one by one
+
+    async def _membership_pages(self, url: str):
+        async for page in iterate_raw_pages(self.graph_client, url):
+            group_ids = [value['id'] for value in page.get('value', [])]
+            next_group_page = page.get('@odata.nextLink')
+            batch = GraphBatch(self.graph_client)
+            futures = {group_id: batch.add("GET", f"/groups/{group_id}/members?$select=id&$top=999")
+                       for group_id in group_ids}
+            await batch.execute()
+            remaining = []
+            rows = []
+            for group_id, future in futures.items():
+                try:
+                    members = future.result() or {}
+                except BatchItemError as error:
+                    if error.status != 404:
+                        raise
+                    continue  # Deleted since the group page was read
+                rows.extend({"group_id": group_id, "member_id": value['id'], "member_type": value.get('@odata.type')}
+                            for value in members.get('value', []))
+                if members.get('@odata.nextLink'):
+                    remaining.append((group_id, members['@odata.nextLink']))
+            for group_id, next_link in remaining:
+                yield rows, next_group_page, False
+                rows = []
+                async for members in iterate_raw_pages(self.graph_client, next_link):
+                    yield [{"group_id": group_id, "member_id": value['id'], "member_type": value.get('@odata.type')}
+                           for value in members.get('value', [])], next_group_page, False
+            yield rows, next_group_page, True
+
+    def _commit_part(self, dataset: str, state: dict, part, rows: int):
+        part.close()
+        temporary = self._part_path(dataset, state["parts"]) + '.tmp'
+        if rows:
+            os.replace(temporary, self._part_path(dataset, state["parts"]))
+            state["parts"] += 1
+            state["rows"] += rows
+        else:
+            os.remove(temporary)
+
+    async def _export_dataset(self, dataset: str, first_url: str, columns: list, pages):
+        state = self.cursor["datasets"].get(dataset)
+        if state is None:
+            state = {"next": first_url, "columns": columns, "parts": 0, "rows": 0, "done": False}
+            self.cursor["datasets"][dataset] = state
+            self._save_cursor()
+        if state["done"]:
+            return state
+        self._remove_uncommitted(dataset, state["parts"])
+        part = None
+        part_rows = 0
+        async for rows, next_link, boundary in pages(state["next"], state["columns"]):
+            if part is None:
+                part = FORMATS[self.format](self._part_path(dataset, state["parts"]) + '.tmp', state["columns"],
+                                            self.compression)
+            if rows:
+                part.write(rows)
+                part_rows += len(rows)
+            if boundary and (part_rows >= self.rows_per_part or not next_link):
+                self._commit_part(dataset, state, part, part_rows)
+                part = None
+                part_rows = 0
+                state["next"] = next_link
+                self._save_cursor()
+        if part is not None:
+            self._commit_part(dataset, state, part, part_rows)
+        state["done"] = True
+        self._save_cursor()
+        return state
+
+    async def _extensions(self, app_setting: str):
+        schema = await self.graph_client.extension_schemas.get(self.settings[app_setting])
+        return dict(schema.readable_names)
+
+    # Export the datasets (All by default). Returns {dataset: {"rows", "parts", "done"}}
+
+    async def export(self, datasets=DATASETS, restart: bool = False):
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_cursor(restart)
+        summary = {}
+        for dataset in datasets:
+            if dataset == 'memberships':
+                url = f"/groups?$select=id&$top={self.group_page_size}"
+                state = await self._export_dataset(
+                    dataset, url, MEMBERSHIP_COLUMNS, lambda next_url, columns: self._membership_pages(next_url))
+            elif dataset in ('users', 'groups'):
+                base = USER_COLUMNS if dataset == 'users' else GROUP_COLUMNS
+                extensions = await self._extensions('user_dir_app' if dataset == 'users' else 'group_dir_app')
+                url = f"/{dataset}?$select={','.join(base + list(extensions))}&$top={self.page_size}"
+
+                def pages(next_url, columns, base=base, extensions=extensions):
+                    # Extension columns are fixed when the dataset starts, a resumed export keeps them
+                    kept = {raw: readable for raw, readable in extensions.items() if readable in columns}
+                    return self._object_pages(next_url, base, kept)
+
+                state = await self._export_dataset(dataset, url, base + list(extensions.values()), pages)
+            else:
+                raise ValueError(f"Unknown dataset {dataset!r}, expected one of {', '.join(DATASETS)}")
+            summary[dataset] = {"rows": state["rows"], "parts": state["parts"], "done": state["done"]}
+        return summary
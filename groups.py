@@ -1,89 +1,111 @@
-import configparser
+from __future__ import annotations
 from configparser import SectionProxy
-from azure.identity.aio import ClientSecretCredential
+from typing import TYPE_CHECKING
 from typing import List,Dict
-import re
 
-from azure.core.exceptions import AzureError
 #from azure.cosmos import CosmosClient, PartitionKey
 
-from kiota_authentication_azure.azure_identity_authentication_provider import (
-    AzureIdentityAuthenticationProvider
-)
-from msgraph import GraphRequestAdapter, GraphServiceClient
-from msgraph.generated.applications.get_available_extension_properties import \
-    get_available_extension_properties_post_request_body
-from msgraph.generated.groups.groups_request_builder import GroupsRequestBuilder
-from msgraph.generated.models.group import Group
-from msgraph.generated.models.reference_create import ReferenceCreate
-from msgraph.generated.models.user import User
-from msgraph.generated.users.users_request_builder import UsersRequestBuilder
-
-config = configparser.ConfigParser()
-config.read(['config.cfg', 'config.dev.cfg'])
-azure_settings = config['azure']
+from client import GraphClient, get_graph_client
+from batching import batch_each
+from configuration import load_config
+from paging import iterate_pages
+from query import Query
+from records import GroupRecord, MemberRecord, iterate_records
+from schema import transform_key
+
+# Only for annotations, the msgraph models and request builders are imported by the methods that use them
+if TYPE_CHECKING:
+    from azure.identity.aio import ClientSecretCredential
+    from msgraph import GraphRequestAdapter, GraphServiceClient
+    from msgraph.generated.models.user import User
+
+
+# groups.config and groups.azure_settings are read from config.cfg on first access, not when groups is imported
+
+def __getattr__(name):
+    if name == 'config':
+        return load_config()
+    if name == 'azure_settings':
+        return load_config()['azure']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 class Groups:
     settings: SectionProxy
     client_credential: ClientSecretCredential
-    request_adapter: GraphRequestAdapter
-    app_client: GraphServiceClient
 
-    def __init__(self, config: SectionProxy):
+    def __init__(self, config: SectionProxy, graph_client: GraphClient = None):
         self.settings = config
-        client_id = self.settings['clientId']
-        tenant_id = self.settings['tenantId']
-        client_secret = self.settings['clientSecret']
-        self.client_credential = ClientSecretCredential(tenant_id, client_id, client_secret)
-        auth_provider = AzureIdentityAuthenticationProvider(self.client_credential)  # type: ignore
-        self.request_adapter = GraphRequestAdapter(auth_provider)
-        self.app_client = GraphServiceClient(self.request_adapter)
-
-    # Get all groups in the tenant  (Only DisplayName and id)
-
-    async def get_all_groups(self):
+        # Credential, token cache and connection pool are shared with every other class using the same app
+        self.graph_client = graph_client or get_graph_client(config)
+        self.client_credential = self.graph_client.client_credential
+
+    # The Kiota adapter and GraphServiceClient are only created when a typed request builder is first used (see client.py)
+
+    @property
+    def request_adapter(self) -> GraphRequestAdapter:
+        return self.graph_client.request_adapter
+
+    @property
+    def app_client(self) -> GraphServiceClient:
+        return self.graph_client.app_client
+
+    # Stream all groups in the tenant  (Only DisplayName and id)
+    # Follows @odata.nextLink, page_size is sent as $top (Maximum 999 for groups)
+    # lightweight=True yields GroupRecord objects parsed straight from the response body (No Kiota models, see records.py)
+
+    async def iter_all_groups(self, page_size: int = 999, lightweight: bool = False):
+        if lightweight:
+            url = f"/groups?$select={GroupRecord.select()}&$orderby=displayName&$top={page_size}"
+            async for record in iterate_records(self.graph_client, url, GroupRecord):
+                yield record
+            return
+        from msgraph.generated.groups.groups_request_builder import GroupsRequestBuilder
+        from msgraph.generated.models.group_collection_response import GroupCollectionResponse
         query_params = GroupsRequestBuilder.GroupsRequestBuilderGetQueryParameters(
             select=['displayName', 'id'],    # You can select other properties as well
-            orderby=['displayName']   # Order by display name
+            orderby=['displayName'],   # Order by display name
+            top=page_size
         )
         request_config = GroupsRequestBuilder.GroupsRequestBuilderGetRequestConfiguration(
             query_parameters=query_params
         )
-
-        groups = await self.app_client.groups.get(request_configuration=request_config)
-        group_details = []
-        for group in groups.value:
+        request_info = self.app_client.groups.to_get_request_information(request_config)
+        async for group in iterate_pages(self.request_adapter, request_info, GroupCollectionResponse):
             group_data = {}
             group_data['displayName'] = group.display_name
             group_data['id'] = group.id
             # Similarly, add other properties
+            yield group_data
+
+    # Query builder for groups, filtered, searched and counted by Graph instead of in Python (see query.py)
+
+    def query(self):
+        return Query(self.graph_client, "/groups", 'group_dir_app', ['displayName', 'id'])
+
+    # Query builder for the direct members of a group that are users. Always an advanced query
+
+    def members_query(self, group_id: str):
+        return Query(self.graph_client, f"/groups/{group_id}/members/microsoft.graph.user", 'user_dir_app',
+                     ['displayName', 'id', 'mail'], advanced=True)
+
+    # Get all groups in the tenant as a list (Use iter_all_groups for large tenants)
+
+    async def get_all_groups(self, page_size: int = 999, lightweight: bool = False):
+        group_details = []
+        async for group_data in self.iter_all_groups(page_size, lightweight):
             group_details.append(group_data)
-        return groups
+        return group_details
     
     # Get all information about a group from its id (Including all members in the group)
 
     async def get_group_by_id(self,group_id):
+        from msgraph.generated.groups.groups_request_builder import GroupsRequestBuilder
+        from msgraph.generated.users.users_request_builder import UsersRequestBuilder
         application_id = self.settings['group_dir_app']
-        application_id = application_id.strip()
-        extension_request_body = get_available_extension_properties_post_request_body.GetAvailableExtensionPropertiesPostRequestBody()
-        extension_request_body.is_synced_from_on_premises = False
-        result = await self.app_client.directory_objects.get_available_extension_properties.post(
-            extension_request_body)
-        extension_property_names_with_app = []
-        extension_property_names = []
-        # Helper function to make the additional data readable.
-        def convert_key(key):
-            sliced_key = key.split('_', 2)[-1]
-            converted_key = re.sub(r'_', ' ', sliced_key)
-            return converted_key
-
-        for value in result.value:
-            if value.name[10:42] == re.sub("-", "", application_id):
-                extension_property_names_with_app.append(value.name)
-                extension_property_names.append(convert_key(value.name))
+        schema = await self.graph_client.extension_schemas.get(application_id)  # Cached, see schema.py
         query_params = GroupsRequestBuilder.GroupsRequestBuilderGetQueryParameters(
             # Selects displayName,id and description, along with all directory extension property values (You can add other attributes in select)
-            select=['displayName', 'id', 'description'] + [str(value) for value in extension_property_names_with_app],
+            select=['displayName', 'id', 'description'] + schema.select,
             orderby=['displayName'],
         )
         request_config = GroupsRequestBuilder.GroupsRequestBuilderGetRequestConfiguration(
@@ -114,20 +136,18 @@ class Groups:
     # Create an M365 unified group from a dictionary 'group_details'. group_details must contain atleast "displayName", "Description"
 
     async def create_group(self, group_details):
+        from msgraph.generated.models.group import Group
         app_id = self.settings['group_dir_app']
         group_name = group_details['displayName']
         #group_properties = group_details["Properties"]   Optional 
         request_body = Group()
         request_body.display_name = group_name
         request_body.mail_enabled = True
-        request_body.mail_nickname = re.sub(' ','_',group_details['Name'])
+        request_body.mail_nickname = group_details['Name'].replace(' ', '_')
         request_body.security_enabled = False
         request_body.group_types = ["Unified",]
         request_body.description = group_details['Description']
-        def transform_key(key):
-            return f"extension_{re.sub('-', '', app_id)}_{re.sub(' ', '_', key)}"
-
-        replace_keys = lambda obj: {transform_key(k): replace_keys(v) if isinstance(v, dict) else v for k, v in
+        replace_keys = lambda obj: {transform_key(app_id, k): replace_keys(v) if isinstance(v, dict) else v for k, v in
                                     obj.items()}
         #additional_data = replace_keys(group_properties)  Optional
         #request_body.additional_data = additional_data  Optional
@@ -139,12 +159,13 @@ class Groups:
         return group_details
     
     # Add users to M365 Group. Provide list of user_ids and one group_id
+    # Requests are sent in $batch envelopes of 20. Returns {user_id: None or the error for that user}
 
-    async def add_users_to_group(self,user_ids:list,group_id:str,user:User):
-        for user_id in user_ids:
-            request_body = ReferenceCreate()
-            request_body.odata_id = f"https://graph.microsoft.com//v1.0//directoryObjects//{user_id}"
-            await self.app_client.groups.by_group_id(group_id).members.ref.post(request_body)
+    async def add_users_to_group(self,user_ids:list,group_id:str,user:User = None):
+        def build_request(user_id):
+            request_body = {"@odata.id": f"https://graph.microsoft.com/v1.0/directoryObjects/{user_id}"}
+            return "POST", f"/groups/{group_id}/members/$ref", request_body
+        return await batch_each(self.graph_client, user_ids, build_request)
 
     # Remove user from group
 
@@ -152,16 +173,20 @@ class Groups:
         await self.app_client.groups.by_group_id(group_id).members.by_directory_object_id(user_id).ref.delete()
 
     # Update group properties (Directory extension properties) Ensure the property exists in the tenant
+    # Updates of the same group made within the client's patchWindow are sent as one PATCH (see coalescing.py)
 
     async def update_group_by_id(self, group_id, property_name: str, property_value: str):
+        await self.update_group_properties(group_id, {property_name: property_value})
+
+    # Update several properties of the group in one PATCH
+    # extensions is keyed by readable directory extension name, properties by Graph property name (e.g. description)
+
+    async def update_group_properties(self, group_id, extensions: dict = None, properties: dict = None):
         group_dir_app = self.settings['group_dir_app']
-        dir_property = f"extension_{re.sub('-', '', group_dir_app)}_" + property_name.replace(" ", "_")
-        request_body = Group()
-        additional_data = {f"{dir_property}": None}
-        additional_data[f"{dir_property}"] = property_value
-        request_body.additional_data = additional_data
-        result = await self.app_client.groups.by_group_id(group_id).patch(request_body)
-        pass
+        request_body = dict(properties or {})
+        for property_name, property_value in (extensions or {}).items():
+            request_body[transform_key(group_dir_app, property_name)] = property_value
+        await self.graph_client.patches.update('groups', group_id, request_body)
 
     # Delete group
 
@@ -170,11 +195,17 @@ class Groups:
 
     # Get users of group (id, displayName, mail)
 
-    async def get_users_of_group(self,group_id:str):     
+    async def get_users_of_group(self,group_id:str, lightweight: bool = False):
+        # Direct members only, across every page. See membership.py for nested groups
+        # lightweight=True returns MemberRecord objects instead of dicts
+        if lightweight:
+            url = f"/groups/{group_id}/members?$select={MemberRecord.select()}&$top=999"
+            return [record async for record in iterate_records(self.graph_client, url, MemberRecord)]
+        from msgraph.generated.models.directory_object_collection_response import DirectoryObjectCollectionResponse
         user_info = []
-        result = await self.app_client.groups.by_group_id(group_id).members.get()
-        for value in result.value:
-            user_data = { "id": value._id, "displayName": value._display_name, "mail": value._mail}
+        request_info = self.app_client.groups.by_group_id(group_id).members.to_get_request_information()
+        async for value in iterate_pages(self.request_adapter, request_info, DirectoryObjectCollectionResponse):
+            user_data = { "id": value.id, "displayName": getattr(value, 'display_name', None), "mail": getattr(value, 'mail', None)}
             user_info.append(user_data)
         return user_info
     
@@ -0,0 +1,292 @@
+import contextlib
+import contextvars
+import math
+import re
+import time
+import httpx
+
+# Path segments that identify one object (GUIDs, user principal names) are folded into {id}
+ID_SEGMENT = re.compile(r'^([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|[^/]*@[^/]*)$')
+
+ADAPTER_METHODS = ['send_async', 'send_collection_async', 'send_collection_of_primitive_async',
+                   'send_primitive_async', 'send_no_response_content_async']
+
+# Records of the HTTP calls made inside the current Instrumentation.measure() block
+_calls = contextvars.ContextVar('graph_calls', default=None)
+
+
+# /v1.0/groups/0f5c...-.../members/$ref -> /groups/{id}/members/$ref
+
+def endpoint_template(path: str):
+    segments = [segment for segment in path.split('/') if segment]
+    if segments and segments[0] in ('v1.0', 'beta'):
+        segments = segments[1:]
+    return '/' + '/'.join('{id}' if ID_SEGMENT.match(segment) else segment for segment in segments)
+
+
+# Histogram with logarithmic buckets (about 5% wide), cheap enough to update on every call
+
+class Histogram:
+    def __init__(self, minimum: float = 1e-6, growth: float = 1.05):
+        self.minimum = minimum
+        self.log_growth = math.log(growth)
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value: float):
+        index = -1 if value <= self.minimum else int(math.log(value / self.minimum) / self.log_growth)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction: float):
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        cumulative = 0
+        for index in sorted(self.buckets):
+            cumulative += self.buckets[index]
+            if cumulative >= target:
+                upper = self.minimum * math.exp((index + 1) * self.log_growth)
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+    # Add the samples of another histogram with the same bucket layout (e.g. one from another process)
+
+    def merge(self, other):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+
+# Counts the bytes of a response body as it is read and reports them when the stream is closed
+
+class CountingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+        self.size = 0
+        self.closed = False
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self.size += len(chunk)
+            yield chunk
+
+    async def aclose(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self.stream.aclose()
+        finally:
+            self.on_close(self.size)
+
+
+# Collects one record per Graph HTTP call:
+#   endpoint (template), method, status, latency (until the body was read), retries, throttle_wait,
+#   request_bytes, response_bytes and deserialize (time spent turning the body into models or dicts)
+# and keeps per endpoint histograms. Hooks receive every record, see opentelemetry_hook.
+
+class Instrumentation:
+    def __init__(self):
+        self.endpoints = {}
+        self.hooks = []
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def _metrics(self, method: str, endpoint: str):
+        key = (method, endpoint)
+        metrics = self.endpoints.get(key)
+        if metrics is None:
+            metrics = {
+                "latency": Histogram(), "deserialize": Histogram(), "throttle_wait": Histogram(),
+                "response_bytes": Histogram(minimum=1), "request_bytes": 0, "retries": 0, "errors": 0,
+            }
+            self.endpoints[key] = metrics
+        return metrics
+
+    def record(self, record: dict):
+        metrics = self._metrics(record["method"], record["endpoint"])
+        metrics["latency"].record(record["latency"])
+        metrics["deserialize"].record(record.get("deserialize", 0.0))
+        metrics["throttle_wait"].record(record.get("throttle_wait", 0.0))
+        metrics["response_bytes"].record(record.get("response_bytes", 0))
+        metrics["request_bytes"] += record.get("request_bytes", 0)
+        metrics["retries"] += record.get("retries", 0)
+        if record.get("status") is None or record["status"] >= 400:
+            metrics["errors"] += 1
+        for hook in self.hooks:
+            hook(record)
+
+    # Add the per endpoint metrics of another Instrumentation (its endpoints attribute, which pickles)
+
+    def merge(self, endpoints: dict):
+        for (method, endpoint), metrics in endpoints.items():
+            target = self._metrics(method, endpoint)
+            for name, value in metrics.items():
+                if isinstance(value, Histogram):
+                    target[name].merge(value)
+                else:
+                    target[name] += value
+
+    # Called by InstrumentedTransport. Inside measure() the record waits for its deserialization time
+
+    def finish(self, record: dict):
+        calls = _calls.get()
+        if calls is None:
+            self.record(record)
+        else:
+            calls.append(record)
+
+    # Wrap one logical call (HTTP round trips plus parsing). Parsing time is what remains after the network time
+
+    @contextlib.asynccontextmanager
+    async def measure(self):
+        calls = []
+        token = _calls.set(calls)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            total = time.perf_counter() - started
+            _calls.reset(token)
+            if calls:
+                network = sum(call["latency"] for call in calls)
+                calls[-1]["deserialize"] = max(0.0, total - network)
+            for call in calls:
+                self.record(call)
+
+    # Route the kiota request adapter's send methods through measure()
+
+    def instrument_adapter(self, request_adapter):
+        for name in ADAPTER_METHODS:
+            original = getattr(request_adapter, name, None)
+            if original is None:
+                continue
+
+            def wrap(original):
+                async def send(*args, **kwargs):
+                    async with self.measure():
+                        return await original(*args, **kwargs)
+                return send
+
+            setattr(request_adapter, name, wrap(original))
+        return request_adapter
+
+    def summary(self):
+        rows = []
+        for (method, endpoint), metrics in self.endpoints.items():
+            latency = metrics["latency"]
+            rows.append({
+                "method": method,
+                "endpoint": endpoint,
+                "calls": latency.count,
+                "total_s": round(latency.sum + metrics["deserialize"].sum, 4),
+                "p50_ms": round(latency.percentile(0.5) * 1000, 2),
+                "p99_ms": round(latency.percentile(0.99) * 1000, 2),
+                "deserialize_ms": round(metrics["deserialize"].mean * 1000, 3),
+                "throttle_wait_s": round(metrics["throttle_wait"].sum, 3),
+                "retries": metrics["retries"],
+                "errors": metrics["errors"],
+                "request_bytes": metrics["request_bytes"],
+                "response_bytes": int(metrics["response_bytes"].sum),
+            })
+        rows.sort(key=lambda row: row["total_s"], reverse=True)
+        return rows
+
+    # Text table, the endpoints that took the most time first
+
+    def report(self):
+        rows = self.summary()
+        if not rows:
+            return "No Graph calls recorded"
+        grand_total = sum(row["total_s"] for row in rows) or 1.0
+        columns = list(rows[0]) + ["share"]
+        values = [[str(row[column]) for column in columns[:-1]] + [f"{row['total_s'] / grand_total:.1%}"]
+                  for row in rows]
+        widths = [max(len(column), *(len(value[index]) for value in values)) for index, column in enumerate(columns)]
+        lines = ["  ".join(column.ljust(width) for column, width in zip(columns, widths))]
+        lines += ["  ".join(value.ljust(width) for value, width in zip(row, widths)) for row in values]
+        return "\n".join(lines)
+
+
+# Hook that forwards every record to OpenTelemetry instruments created from `meter`
+# (opentelemetry.metrics.get_meter(...)). Nothing is imported from OpenTelemetry here.
+
+def opentelemetry_hook(meter):
+    duration = meter.create_histogram("graph.client.request.duration", unit="s",
+                                      description="Duration of Microsoft Graph HTTP calls")
+    deserialize = meter.create_histogram("graph.client.deserialize.duration", unit="s",
+                                         description="Time spent parsing Microsoft Graph responses")
+    throttle_wait = meter.create_histogram("graph.client.throttle.wait", unit="s",
+                                           description="Time spent waiting for rate limits and Retry-After")
+    response_size = meter.create_histogram("graph.client.response.size", unit="By",
+                                           description="Size of Microsoft Graph response bodies")
+    retries = meter.create_counter("graph.client.retries", description="Retried Microsoft Graph calls")
+
+    def hook(record: dict):
+        attributes = {
+            "http.request.method": record["method"],
+            "url.template": record["endpoint"],
+            "http.response.status_code": record.get("status") or 0,
+        }
+        duration.record(record["latency"], attributes)
+        deserialize.record(record.get("deserialize", 0.0), attributes)
+        throttle_wait.record(record.get("throttle_wait", 0.0), attributes)
+        response_size.record(record.get("response_bytes", 0), attributes)
+        if record.get("retries"):
+            retries.add(record["retries"], attributes)
+
+    return hook
+
+
+# Outermost httpx transport of the GraphClient. The retries and throttle waits are filled in by
+# ThrottlingTransport through request.extensions["graph_metrics"]
+
+class InstrumentedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, instrumentation: Instrumentation):
+        self.transport = transport
+        self.instrumentation = instrumentation
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        content = await request.aread()
+        metrics = {}
+        request.extensions['graph_metrics'] = metrics
+        record = {"method": request.method, "endpoint": endpoint_template(request.url.path),
+                  "request_bytes": len(content)}
+        started = time.perf_counter()
+        try:
+            response = await self.transport.handle_async_request(request)
+        except Exception:
+            record.update(metrics, status=None, latency=time.perf_counter() - started)
+            self.instrumentation.finish(record)
+            raise
+        record["status"] = response.status_code
+
+        def on_close(size):
+            record.update(metrics, latency=time.perf_counter() - started, response_bytes=size)
+            self.instrumentation.finish(record)
+
+        if response.is_stream_consumed or response.is_closed:
+            # Already read by the transport (e.g. httpx.Response(content=...)), its stream is never closed again
+            on_close(len(response.content))
+            return response
+        response.stream = CountingStream(response.stream, on_close)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,112 @@
+import argparse
+import asyncio
+import json
+from client import close_all_clients
+from configuration import load_settings
+
+
+# python main.py provision users.csv --output created.jsonl [--checkpoint created.jsonl.checkpoint] [--concurrency 16]
+
+async def provision(args):
+    from provisioning import BulkProvisioner, read_user_records
+    from users import Users
+    users = Users(load_settings())
+    provisioner = BulkProvisioner(users, concurrency=args.concurrency)
+    return await provisioner.provision(read_user_records(args.input), args.output, args.checkpoint)
+
+
+# python main.py reconcile desired.json [--dry-run] [--no-prune]
+
+async def reconcile(args):
+    from client import get_graph_client
+    from reconcile import Reconciler, load_desired_state
+    reconciler = Reconciler(get_graph_client(load_settings()), prune=args.prune, max_concurrency=args.concurrency)
+    return await reconciler.reconcile(load_desired_state(args.desired), dry_run=args.dry_run)
+
+
+# python main.py export exports/ [--format jsonl|parquet] [--compression gzip] [--datasets users,groups,memberships]
+#                       [--rows-per-part 100000] [--restart]
+
+async def export(args):
+    from client import get_graph_client
+    from export import DirectoryExporter
+    exporter = DirectoryExporter(get_graph_client(load_settings()), args.directory, format=args.format,
+                                 compression=args.compression, rows_per_part=args.rows_per_part)
+    return await exporter.export(args.datasets, restart=args.restart)
+
+
+# python main.py tenants export|delta|provision [--tenants a,b] [--workers 8] [--shard-size 8] [--output dir]
+#                        [--input users-{tenant}.csv]
+
+async def tenants(args):
+    from multitenant import MultiTenantRunner, load_tenants
+    runner = MultiTenantRunner(load_tenants(names=args.tenants), workers=args.workers, shard_size=args.shard_size)
+    options = {"output": args.output, "input": args.input, "concurrency": args.concurrency,
+               "format": args.format, "compression": args.compression}
+    if args.job == 'provision' and not args.input:
+        raise SystemExit("tenants provision needs --input")
+    result = await runner.run(args.job, options)
+    if args.report:
+        print(runner.instrumentation.report(), end="\n\n")
+    return result
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Microsoft Graph SDK examples")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    provision_parser = commands.add_parser('provision', help="Create users from a CSV or JSONL file")
+    provision_parser.add_argument('input', help="CSV (with header row) or JSONL file of user records")
+    provision_parser.add_argument('--output', required=True, help="JSONL file the results are appended to")
+    provision_parser.add_argument('--checkpoint', help="Checkpoint file (Default: <output>.checkpoint)")
+    provision_parser.add_argument('--concurrency', type=int, default=16)
+    provision_parser.set_defaults(handler=provision)
+
+    reconcile_parser = commands.add_parser('reconcile', help="Bring users and groups to a desired state")
+    reconcile_parser.add_argument('desired', help="JSON file with the desired state, see reconcile.py")
+    reconcile_parser.add_argument('--dry-run', action='store_true', help="Print the plan without writing")
+    reconcile_parser.add_argument('--no-prune', dest='prune', action='store_false',
+                                  help="Do not remove group members missing from the desired state")
+    reconcile_parser.add_argument('--concurrency', type=int, default=4)
+    reconcile_parser.set_defaults(handler=reconcile)
+
+    export_parser = commands.add_parser('export', help="Export users, groups and memberships to JSONL or Parquet")
+    export_parser.add_argument('directory', help="Output directory, an unfinished export in it is resumed")
+    export_parser.add_argument('--format', choices=['jsonl', 'parquet'], default='jsonl')
+    export_parser.add_argument('--compression', help="gzip for JSONL, snappy/zstd/gzip for Parquet (Default: none)")
+    export_parser.add_argument('--datasets', type=lambda value: value.split(','), default=['users', 'groups', 'memberships'])
+    export_parser.add_argument('--rows-per-part', type=int, default=100000)
+    export_parser.add_argument('--restart', action='store_true', help="Ignore the cursor of an earlier export")
+    export_parser.set_defaults(handler=export)
+
+    tenants_parser = commands.add_parser('tenants', help="Run a job for every [tenant:...] section on a process pool")
+    tenants_parser.add_argument('job', choices=['export', 'delta', 'provision'])
+    tenants_parser.add_argument('--tenants', type=lambda value: value.split(','), help="Only these tenants (Default: all)")
+    tenants_parser.add_argument('--workers', type=int, help="Worker processes (Default: CPU count)")
+    tenants_parser.add_argument('--shard-size', type=int, default=8, help="Tenants run concurrently per worker")
+    tenants_parser.add_argument('--output', help="Output directory")
+    tenants_parser.add_argument('--input', help="provision: user file per tenant, {tenant} is replaced by the name")
+    tenants_parser.add_argument('--concurrency', type=int, default=16, help="provision: concurrent creates per tenant")
+    tenants_parser.add_argument('--format', choices=['jsonl', 'parquet'], default='jsonl', help="export: file format")
+    tenants_parser.add_argument('--compression', help="export: gzip for JSONL, snappy/zstd/gzip for Parquet")
+    tenants_parser.add_argument('--report', action='store_true', help="Print the merged instrumentation report")
+    tenants_parser.set_defaults(handler=tenants)
+    return parser
+
+
+async def run(args):
+    try:
+        return await args.handler(args)
+    finally:
+        await close_all_clients()
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    result = asyncio.run(run(args))
+    if result is not None:
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
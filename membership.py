@@ -0,0 +1,342 @@
+from batching import batch_get_all
+from paging import iterate_raw_pages
+
+GROUP_TYPE = '#microsoft.graph.group'
+
+
+# Strongly connected components of the group -> subgroup graph (iterative Tarjan, no recursion limit).
+# Components come out children first: every component is emitted after all components it contains.
+
+def strongly_connected_components(children: list):
+    count = len(children)
+    index = [-1] * count
+    lowlink = [0] * count
+    on_stack = [False] * count
+    stack = []
+    components = []
+    counter = 0
+    for root in range(count):
+        if index[root] != -1:
+            continue
+        work = [(root, iter(children[root]))]
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        while work:
+            node, successors = work[-1]
+            advanced = False
+            for child in successors:
+                if index[child] == -1:
+                    index[child] = lowlink[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack[child] = True
+                    work.append((child, iter(children[child])))
+                    advanced = True
+                    break
+                if on_stack[child]:
+                    lowlink[node] = min(lowlink[node], index[child])
+            if advanced:
+                continue
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+    return components
+
+
+# Group -> member edges with the transitive closure of nested groups.
+# Groups that contain other groups get a nesting index. Every group keeps the set of groups that contain it
+# (directly or through nesting) as a bitset over nesting indexes, so the bitsets are only as wide as the number
+# of groups that contain groups, and a group nested in nothing stores 0.
+# "Is user X in group Y" is one bit test per direct group of X. Groups in a cycle share one bitset.
+# Member additions are applied in place; removals of nested groups and additions that close a cycle rebuild
+# the closure on the next query. At most cache_size users and groups have their expanded memberships cached.
+
+class MembershipGraph:
+    def __init__(self, cache_size: int = 10000):
+        self.group_index = {}
+        self.group_ids = []
+        self.children = []
+        self.parents = []
+        self.direct_users = []
+        self.user_groups = {}
+        self.nesting = []           # Group index -> nesting index, or -1 for groups without nested groups
+        self.nesting_groups = []    # Nesting index -> group index
+        self.ancestors = []
+        self.dirty = False
+        self.cache_size = cache_size
+        self.user_cache = {}
+        self.group_cache = {}
+
+    def _group(self, group_id: str):
+        index = self.group_index.get(group_id)
+        if index is None:
+            index = len(self.group_ids)
+            self.group_index[group_id] = index
+            self.group_ids.append(group_id)
+            self.children.append(set())
+            self.parents.append(set())
+            self.direct_users.append(set())
+            self.nesting.append(-1)
+            self.ancestors.append(0)
+        return index
+
+    def _nesting_bit(self, index: int):
+        if self.nesting[index] == -1:
+            self.nesting[index] = len(self.nesting_groups)
+            self.nesting_groups.append(index)
+        return 1 << self.nesting[index]
+
+    def _contains(self, bits: int, index: int):
+        return self.nesting[index] != -1 and bool(bits >> self.nesting[index] & 1)
+
+    def _clear_caches(self):
+        self.user_cache.clear()
+        self.group_cache.clear()
+
+    # Cached users of a group are stale once a user joins or leaves it or any group nested in it
+
+    def _forget_users_of(self, index: int):
+        self.group_cache.pop(index, None)
+        for nesting_index in self._bits(self.ancestors[index]):
+            self.group_cache.pop(self.nesting_groups[nesting_index], None)
+
+    def _remember(self, cache: dict, key, value):
+        if len(cache) >= self.cache_size:
+            del cache[next(iter(cache))]  # Oldest entry first
+        cache[key] = value
+        return value
+
+    # Edges
+
+    def add_member(self, group_id: str, member_id: str, member_type: str = None):
+        parent = self._group(group_id)
+        if member_type == GROUP_TYPE or member_id in self.group_index and member_type is None:
+            child = self._group(member_id)
+            if child in self.children[parent]:
+                return
+            self.children[parent].add(child)
+            self.parents[child].add(parent)
+            parent_bit = self._nesting_bit(parent)
+            if not self.dirty:
+                if child == parent or self._contains(self.ancestors[parent], child):
+                    self.dirty = True  # The new edge closes a cycle
+                else:
+                    inherited = self.ancestors[parent] | parent_bit
+                    for index in self._descendants(child):
+                        self.ancestors[index] |= inherited
+                self._clear_caches()
+            return
+        if member_id in self.direct_users[parent]:
+            return
+        self.direct_users[parent].add(member_id)
+        self.user_groups.setdefault(member_id, set()).add(parent)
+        if not self.dirty:  # A bulk load rebuilds the closure and clears the caches once at the end
+            self.user_cache.pop(member_id, None)
+            self._forget_users_of(parent)
+
+    def remove_member(self, group_id: str, member_id: str):
+        parent = self.group_index.get(group_id)
+        if parent is None:
+            return
+        child = self.group_index.get(member_id)
+        if child is not None and child in self.children[parent]:
+            self.children[parent].discard(child)
+            self.parents[child].discard(parent)
+            self.dirty = True
+            self._clear_caches()
+            return
+        if member_id in self.direct_users[parent]:
+            self.direct_users[parent].discard(member_id)
+            self.user_groups.get(member_id, set()).discard(parent)
+            if not self.dirty:
+                self.user_cache.pop(member_id, None)
+                self._forget_users_of(parent)
+
+    def remove_group(self, group_id: str):
+        index = self.group_index.get(group_id)
+        if index is None:
+            return
+        for child in list(self.children[index]):
+            self.parents[child].discard(index)
+        for parent in list(self.parents[index]):
+            self.children[parent].discard(index)
+        for user_id in self.direct_users[index]:
+            self.user_groups.get(user_id, set()).discard(index)
+        self.children[index] = set()
+        self.parents[index] = set()
+        self.direct_users[index] = set()
+        self.dirty = True
+        self._clear_caches()
+
+    def remove_user(self, user_id: str):
+        for index in self.user_groups.pop(user_id, set()):
+            self.direct_users[index].discard(user_id)
+        self._clear_caches()
+
+    # Apply a DeltaSync event
+
+    def apply(self, event: dict):
+        if event["resource"] == 'users':
+            if event["change"] == 'removed':
+                self.remove_user(event["id"])
+        elif event["change"] == 'member_added':
+            self.add_member(event["id"], event["member_id"], event.get("member_type"))
+        elif event["change"] == 'member_removed':
+            self.remove_member(event["id"], event["member_id"])
+        elif event["change"] == 'removed':
+            self.remove_group(event["id"])
+        else:
+            self._group(event["id"])
+
+    # Closure
+
+    # Positions of the set bits, lowest first
+
+    @staticmethod
+    def _bits(bits: int):
+        while bits:
+            lowest = bits & -bits
+            yield lowest.bit_length() - 1
+            bits ^= lowest
+
+    def _descendants(self, index: int):
+        seen = {index}
+        pending = [index]
+        while pending:
+            for child in self.children[pending.pop()]:
+                if child not in seen:
+                    seen.add(child)
+                    pending.append(child)
+        return seen
+
+    def build(self):
+        ancestors = [0] * len(self.group_ids)
+        # Parents first, so every component sees the finished closure of the groups that contain it
+        for component in reversed(strongly_connected_components(self.children)):
+            bits = 0
+            if len(component) > 1 or component[0] in self.children[component[0]]:
+                for index in component:
+                    bits |= self._nesting_bit(index)  # Every group of a cycle contains the others
+            members = set(component)
+            for index in component:
+                for parent in self.parents[index]:
+                    if parent not in members:
+                        bits |= ancestors[parent] | self._nesting_bit(parent)
+            if bits:
+                for index in component:
+                    ancestors[index] = bits
+        self.ancestors = ancestors
+        self.dirty = False
+        self._clear_caches()
+
+    def _ensure(self):
+        if self.dirty:
+            self.build()
+
+    # Bitset of the groups containing a direct group of the user (The direct groups are in user_groups)
+
+    def _user_bits(self, user_id: str):
+        bits = self.user_cache.get(user_id)
+        if bits is None:
+            bits = 0
+            for index in self.user_groups.get(user_id, ()):
+                bits |= self.ancestors[index]
+            bits = self._remember(self.user_cache, user_id, bits)
+        return bits
+
+    # Queries
+
+    def is_member(self, user_id: str, group_id: str):
+        self._ensure()
+        index = self.group_index.get(group_id)
+        if index is None:
+            return False
+        return index in self.user_groups.get(user_id, ()) or self._contains(self._user_bits(user_id), index)
+
+    # Ids of every group the user is in, directly or through nested groups
+
+    def groups_of_user(self, user_id: str):
+        self._ensure()
+        groups = set(self.user_groups.get(user_id, ()))
+        groups.update(self.nesting_groups[nesting_index] for nesting_index in self._bits(self._user_bits(user_id)))
+        return [self.group_ids[index] for index in sorted(groups)]
+
+    # Ids of every user in the group, directly or through nested groups
+
+    def users_of_group(self, group_id: str):
+        self._ensure()
+        index = self.group_index.get(group_id)
+        if index is None:
+            return set()
+        users = self.group_cache.get(index)
+        if users is None:
+            users = set()
+            for descendant in self._descendants(index):
+                users.update(self.direct_users[descendant])
+            users = self._remember(self.group_cache, index, frozenset(users))
+        return users
+
+    def is_nested_in(self, group_id: str, parent_id: str):
+        self._ensure()
+        index = self.group_index.get(group_id)
+        parent = self.group_index.get(parent_id)
+        if index is None or parent is None:
+            return False
+        return index == parent or self._contains(self.ancestors[index], parent)
+
+    # Loading
+
+    @classmethod
+    def from_edges(cls, edges):
+        graph = cls()
+        graph.dirty = True  # One closure build after all edges instead of incremental updates
+        for group_id, member_id, member_type in edges:
+            graph.add_member(group_id, member_id, member_type)
+        graph.build()
+        return graph
+
+    @classmethod
+    def from_mirror(cls, mirror):
+        graph = cls()
+        graph.dirty = True
+        for (group_id,) in mirror.connection.execute("SELECT id FROM groups"):
+            graph._group(group_id)
+        for group_id, member_id, member_type in mirror.connection.execute(
+                "SELECT group_id, member_id, member_type FROM memberships"):
+            graph.add_member(group_id, member_id, member_type)
+        graph.build()
+        return graph
+
+    # Load every group -> member edge from Graph. The first page of members of 20 groups is requested
+    # per $batch envelope, only groups with more than 999 members need further requests.
+
+    @classmethod
+    async def load(cls, graph_client, concurrency: int = 8):
+        group_ids = []
+        async for page in iterate_raw_pages(graph_client, "/groups?$select=id&$top=999"):
+            group_ids.extend(value["id"] for value in page.get("value", []))
+        graph = cls()
+        graph.dirty = True
+        for group_id in group_ids:
+            graph._group(group_id)
+        urls = {group_id: f"/groups/{group_id}/members?$select=id&$top=999" for group_id in group_ids}
+        members = await batch_get_all(graph_client, urls, max_concurrency=concurrency)
+        for group_id, values in members.items():
+            if isinstance(values, Exception):
+                raise values
+            for value in values:
+                graph.add_member(group_id, value["id"], value.get("@odata.type"))
+        graph.build()
+        return graph
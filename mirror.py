@@ -0,0 +1,212 @@
+import json
+import sqlite3
+from delta import DeltaStore, DeltaSync, GROUP_SELECT, USER_SELECT
+from schema import transform_key
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        upn TEXT,
+        display_name TEXT,
+        job_title TEXT,
+        mail TEXT,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS users_upn ON users (upn COLLATE NOCASE);
+    CREATE INDEX IF NOT EXISTS users_display_name ON users (display_name);
+    CREATE TABLE IF NOT EXISTS groups (
+        id TEXT PRIMARY KEY,
+        display_name TEXT,
+        description TEXT,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS groups_display_name ON groups (display_name);
+    CREATE TABLE IF NOT EXISTS memberships (
+        group_id TEXT NOT NULL,
+        member_id TEXT NOT NULL,
+        member_type TEXT,
+        PRIMARY KEY (group_id, member_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS memberships_member ON memberships (member_id, group_id);
+    CREATE TABLE IF NOT EXISTS extension_values (
+        object_id TEXT NOT NULL,
+        name TEXT NOT NULL,
+        value TEXT,
+        PRIMARY KEY (object_id, name)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS extension_values_lookup ON extension_values (name, value);
+"""
+
+# Read-only local copy of users, groups, memberships and directory extension values in SQLite.
+# refresh() loads everything on the first run and afterwards applies /delta changes only.
+# The delta links live in the same database and are committed in the same transaction as the data,
+# so the mirror never gets ahead of or behind its delta link.
+# The read methods return the same shapes as Users and Groups and never call Graph.
+
+class DirectoryMirror:
+    def __init__(self, graph_client, path: str = 'directory.sqlite3'):
+        self.graph_client = graph_client
+        self.settings = graph_client.settings
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self.store = DeltaStore(connection=self.connection)
+        self.reset_groups = set()  # Groups whose member list a full read has already started over in this refresh
+
+    async def _sync(self):
+        user_schema = await self.graph_client.extension_schemas.get(self.settings['user_dir_app'])
+        group_schema = await self.graph_client.extension_schemas.get(self.settings['group_dir_app'])
+        return DeltaSync(self.graph_client, self.store,
+                         user_select=USER_SELECT + user_schema.select,
+                         group_select=GROUP_SELECT + group_schema.select)
+
+    # Apply the changes since the last refresh (Everything on the first call). Returns the number of events applied
+
+    async def refresh(self):
+        sync = await self._sync()
+        self.reset_groups = set()
+        count = 0
+        async for event in sync.sync():
+            self.apply(event)
+            count += 1
+        return count
+
+    # Drop the local copy and the delta links, then load the whole directory again
+
+    async def full_load(self):
+        with self.connection:
+            for table in ('users', 'groups', 'memberships', 'extension_values', 'delta_links', 'known_objects'):
+                self.connection.execute(f"DELETE FROM {table}")
+        return await self.refresh()
+
+    def _merged(self, table: str, object_id: str, data: dict, full: bool):
+        row = None if full else self.connection.execute(f"SELECT data FROM {table} WHERE id = ?", (object_id,)).fetchone()
+        merged = json.loads(row[0]) if row else {}
+        # Outside a full read /delta may only return the properties that changed
+        merged.update({key: value for key, value in data.items() if not key.startswith('@')})
+        return merged
+
+    def _write_extensions(self, object_id: str, data: dict):
+        self.connection.execute("DELETE FROM extension_values WHERE object_id = ?", (object_id,))
+        self.connection.executemany(
+            "INSERT INTO extension_values VALUES (?, ?, ?)",
+            [(object_id, key, value) for key, value in data.items() if key.startswith('extension_') and value is not None])
+
+    def _remove(self, table: str, object_id: str):
+        self.connection.execute(f"DELETE FROM {table} WHERE id = ?", (object_id,))
+        self.connection.execute("DELETE FROM extension_values WHERE object_id = ?", (object_id,))
+        self.connection.execute("DELETE FROM memberships WHERE group_id = ? OR member_id = ?", (object_id, object_id))
+
+    # Apply one DeltaSync event. Committed by DeltaSync together with the new delta link
+
+    def apply(self, event: dict):
+        change = event["change"]
+        object_id = event["id"]
+        if event["resource"] == 'users':
+            if change == 'removed':
+                self._remove('users', object_id)
+                return
+            data = self._merged('users', object_id, event["data"], event.get("full"))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?)",
+                (object_id, data.get('userPrincipalName'), data.get('displayName'), data.get('jobTitle'),
+                 data.get('mail'), json.dumps(data)))
+            self._write_extensions(object_id, data)
+            return
+        if change == 'member_added':
+            self.connection.execute("INSERT OR REPLACE INTO memberships VALUES (?, ?, ?)",
+                                    (object_id, event["member_id"], event.get("member_type")))
+        elif change == 'member_removed':
+            self.connection.execute("DELETE FROM memberships WHERE group_id = ? AND member_id = ?",
+                                    (object_id, event["member_id"]))
+        elif change == 'removed':
+            self._remove('groups', object_id)
+        else:
+            data = self._merged('groups', object_id, event["data"], event.get("full"))
+            self.connection.execute("INSERT OR REPLACE INTO groups VALUES (?, ?, ?, ?)",
+                                    (object_id, data.get('displayName'), data.get('description'), json.dumps(data)))
+            self._write_extensions(object_id, data)
+            if event.get("full") and object_id not in self.reset_groups:
+                # A full read lists every member after this event, start from an empty member list.
+                # Large groups come back several times with part of their members each, only the first clears
+                self.reset_groups.add(object_id)
+                self.connection.execute("DELETE FROM memberships WHERE group_id = ?", (object_id,))
+
+    def _raw_name(self, name: str, app_setting: str):
+        if name.startswith('extension_'):
+            return name
+        return transform_key(self.settings[app_setting], name)
+
+    # Same results as Users / Groups
+
+    async def get_user_by_id(self, id_num: str):
+        row = self.connection.execute("SELECT data FROM users WHERE id = ?", (id_num,)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        return {
+            "Name": data.get('displayName'),
+            "jobTitle": data.get('jobTitle'),
+            "id": id_num,
+            "properties": {key: value for key, value in data.items() if key.startswith('extension_')},
+        }
+
+    async def get_all_users(self):
+        cursor = self.connection.execute("SELECT display_name, id, job_title FROM users ORDER BY display_name")
+        return [{"Name": name, "id": user_id, "jobTitle": job_title} for name, user_id, job_title in cursor]
+
+    async def get_groups_of_user(self, user_id: str):
+        cursor = self.connection.execute("SELECT group_id FROM memberships WHERE member_id = ?", (user_id,))
+        return [row[0] for row in cursor]
+
+    async def get_all_groups(self):
+        cursor = self.connection.execute("SELECT display_name, id FROM groups ORDER BY display_name")
+        return [{"displayName": name, "id": group_id} for name, group_id in cursor]
+
+    async def get_users_of_group(self, group_id: str):
+        cursor = self.connection.execute(
+            "SELECT memberships.member_id, users.display_name, users.mail FROM memberships "
+            "LEFT JOIN users ON users.id = memberships.member_id WHERE memberships.group_id = ?", (group_id,))
+        return [{"id": member_id, "displayName": name, "mail": mail} for member_id, name, mail in cursor]
+
+    async def get_group_by_id(self, group_id: str):
+        row = self.connection.execute("SELECT data FROM groups WHERE id = ?", (group_id,)).fetchone()
+        if row is None:
+            return None
+        data = json.loads(row[0])
+        return {
+            "Name": data.get('displayName'),
+            "id": group_id,
+            "description": data.get('description'),
+            "properties": {key: value for key, value in data.items() if key.startswith('extension_')},
+            "members": await self.get_users_of_group(group_id),
+        }
+
+    # Indexed lookups
+
+    async def find_user_by_upn(self, upn: str):
+        row = self.connection.execute("SELECT id FROM users WHERE upn = ? COLLATE NOCASE", (upn,)).fetchone()
+        return await self.get_user_by_id(row[0]) if row else None
+
+    async def find_users_by_display_name(self, display_name: str):
+        cursor = self.connection.execute("SELECT id FROM users WHERE display_name = ?", (display_name,))
+        return [row[0] for row in cursor]
+
+    async def find_groups_by_display_name(self, display_name: str):
+        cursor = self.connection.execute("SELECT id FROM groups WHERE display_name = ?", (display_name,))
+        return [row[0] for row in cursor]
+
+    # Ids of the users (or groups) whose extension property (readable or extension_... name) equals value
+
+    async def find_by_extension(self, property_name: str, value: str, object_type: str = 'User'):
+        app_setting = 'user_dir_app' if object_type == 'User' else 'group_dir_app'
+        table = 'users' if object_type == 'User' else 'groups'
+        cursor = self.connection.execute(
+            f"SELECT extension_values.object_id FROM extension_values JOIN {table} ON {table}.id = extension_values.object_id "
+            "WHERE extension_values.name = ? AND extension_values.value = ?",
+            (self._raw_name(property_name, app_setting), value))
+        return [row[0] for row in cursor]
+
+    def close(self):
+        self.connection.close()
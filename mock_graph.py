@@ -0,0 +1,600 @@
+import argparse
+import asyncio
+import configparser
+import json
+import random
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, unquote, urlencode, urlsplit
+import httpx
+from azure.core.credentials import AccessToken
+
+MOCK_URL = 'https://graph.microsoft.com/v1.0'
+USER_DIR_APP = '00000000-0000-0000-0000-00000000a001'
+USER_DIR_OBJ = '00000000-0000-0000-0000-00000000b001'
+GROUP_DIR_APP = '00000000-0000-0000-0000-00000000a002'
+GROUP_DIR_OBJ = '00000000-0000-0000-0000-00000000b002'
+
+USER_TYPE = '#microsoft.graph.user'
+GROUP_TYPE = '#microsoft.graph.group'
+
+FILTER_TOKEN = re.compile(r"\s*(?:('(?:[^']|'')*')|(-?\d+(?:\.\d+)?)|([A-Za-z_][\w.@]*)|([(),]))")
+SEARCH_TERM = re.compile(r'"([^":]+):([^"]*)"')
+COMPARISONS = {'eq', 'ne', 'lt', 'le', 'gt', 'ge'}
+
+
+# [azure] settings pointing at the mock owner applications. Rate limits are raised so the client,
+# not the local throttle, is what gets measured.
+
+def mock_settings(**overrides):
+    config = configparser.ConfigParser()
+    config['azure'] = {
+        'clientId': 'mock-client', 'clientSecret': 'mock-secret', 'tenantId': 'mock-tenant',
+        'user_dir_app': USER_DIR_APP, 'user_dir_obj': USER_DIR_OBJ,
+        'group_dir_app': GROUP_DIR_APP, 'group_dir_obj': GROUP_DIR_OBJ,
+        'domain': 'mock.onmicrosoft.com', 'http2': 'false',
+        'requestsPerSecond': '100000', 'burst': '100000', 'maxConcurrency': '256', 'workloadConcurrency': '256',
+    }
+    config['azure'].update({key: str(value) for key, value in overrides.items()})
+    return config['azure']
+
+
+# Credential for the mock, never talks to the identity platform
+
+class StaticTokenCredential:
+    async def get_token(self, *scopes, **kwargs):
+        return AccessToken('mock-token', int(time.time()) + 3600)
+
+    async def close(self):
+        pass
+
+
+def error(status: int, code: str, message: str):
+    return status, {}, {"error": {"code": code, "message": message}}
+
+
+def _normalized(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def _compare(operator: str, current, value):
+    current, value = _normalized(current), _normalized(value)
+    if operator == 'eq':
+        return current == value
+    if operator == 'ne':
+        return current != value
+    if current is None or value is None:
+        return False
+    return {'lt': current < value, 'le': current <= value, 'gt': current > value, 'ge': current >= value}[operator]
+
+
+# Subset of the $filter grammar Graph supports on users and groups: eq/ne/lt/le/gt/ge, in, startswith, endswith,
+# and/or/not and parentheses. advanced is set when Graph would require ConsistencyLevel: eventual.
+
+class FilterParser:
+    def __init__(self, expression: str):
+        self.tokens = []
+        self.index = 0
+        self.advanced = False
+        position = 0
+        while expression[position:].strip():
+            match = FILTER_TOKEN.match(expression, position)
+            if match is None or match.end() == position:
+                raise ValueError(f"Invalid filter near {expression[position:]!r}")
+            position = match.end()
+            string, number, name, punctuation = match.groups()
+            if string is not None:
+                self.tokens.append(('literal', string[1:-1].replace("''", "'")))
+            elif number is not None:
+                self.tokens.append(('literal', float(number) if '.' in number else int(number)))
+            elif name is not None and name.lower() in ('true', 'false', 'null'):
+                self.tokens.append(('literal', {'true': True, 'false': False, 'null': None}[name.lower()]))
+            elif name is not None:
+                self.tokens.append(('name', name))
+            else:
+                self.tokens.append((punctuation, punctuation))
+
+    def peek(self):
+        return self.tokens[self.index] if self.index < len(self.tokens) else (None, None)
+
+    def take(self, kind: str):
+        token = self.peek()
+        if token[0] != kind:
+            raise ValueError(f"Expected {kind} in filter, got {token[1]!r}")
+        self.index += 1
+        return token[1]
+
+    def keyword(self, word: str):
+        kind, value = self.peek()
+        return kind == 'name' and value.lower() == word
+
+    def parse(self):
+        predicate = self.disjunction()
+        if self.index != len(self.tokens):
+            raise ValueError(f"Unexpected {self.peek()[1]!r} in filter")
+        return predicate
+
+    def disjunction(self):
+        predicate = self.conjunction()
+        while self.keyword('or'):
+            self.index += 1
+            left, right = predicate, self.conjunction()
+            predicate = lambda value, left=left, right=right: left(value) or right(value)
+        return predicate
+
+    def conjunction(self):
+        predicate = self.negation()
+        while self.keyword('and'):
+            self.index += 1
+            left, right = predicate, self.negation()
+            predicate = lambda value, left=left, right=right: left(value) and right(value)
+        return predicate
+
+    def negation(self):
+        if self.keyword('not'):
+            self.index += 1
+            self.advanced = True
+            inner = self.negation()
+            return lambda value: not inner(value)
+        return self.comparison()
+
+    def field(self):
+        name = self.take('name')
+        if name.startswith('extension_'):
+            self.advanced = True
+        return name
+
+    def comparison(self):
+        if self.peek()[0] == '(':
+            self.index += 1
+            predicate = self.disjunction()
+            self.take(')')
+            return predicate
+        if self.peek()[1] in ('startswith', 'endswith') and self.tokens[self.index + 1:self.index + 2] == [('(', '(')]:
+            function = self.take('name')
+            self.take('(')
+            name = self.field()
+            self.take(',')
+            text = str(self.take('literal')).lower()
+            self.take(')')
+            if function == 'endswith':
+                self.advanced = True
+                return lambda value: str(value.get(name) or '').lower().endswith(text)
+            return lambda value: str(value.get(name) or '').lower().startswith(text)
+        name = self.field()
+        operator = self.take('name').lower()
+        if operator == 'in':
+            self.take('(')
+            values = {_normalized(self.take('literal'))}
+            while self.peek()[0] == ',':
+                self.index += 1
+                values.add(_normalized(self.take('literal')))
+            self.take(')')
+            return lambda value: _normalized(value.get(name)) in values
+        if operator not in COMPARISONS:
+            raise ValueError(f"Unsupported filter operator {operator!r}")
+        if operator == 'ne':
+            self.advanced = True
+        expected = self.take('literal')
+        return lambda value: _compare(operator, value.get(name), expected)
+
+
+def search_predicate(search: str):
+    terms = SEARCH_TERM.findall(search)
+    if not terms:
+        raise ValueError(f"Invalid search {search!r}")
+    terms = [(name, text.lower()) for name, text in terms]
+    return lambda value: all(text in str(value.get(name) or '').lower() for name, text in terms)
+
+
+# In-memory directory with users, groups, members, owner applications and extension properties.
+# handle() answers one Graph request and is shared by the httpx transport, $batch and the HTTP server.
+
+class MockGraph:
+    def __init__(self, page_size: int = 100):
+        self.page_size = page_size
+        self.users = {}
+        self.user_names = {}
+        self.groups = {}
+        self.members = {}
+        self.member_of = {}
+        self.applications = {USER_DIR_OBJ: USER_DIR_APP, GROUP_DIR_OBJ: GROUP_DIR_APP}
+        self.extension_properties = {}
+        self.log = []
+        self.sequence = 0
+        self.delta_horizon = -1
+        self.version = 0
+        self.sorted_cache = {}
+        self.requests = 0       # HTTP round trips, a $batch envelope counts once (Counted by the transport / server)
+        self.sub_requests = 0   # Requests carried inside $batch envelopes
+
+    # Populate the directory with deterministic users, groups and memberships
+
+    def seed(self, users: int = 1000, groups: int = 50, members_per_group: int = 20, extension_names=(), seed: int = 1):
+        generator = random.Random(seed)
+        for name in extension_names:
+            self.add_extension_property(USER_DIR_OBJ, name, 'User')
+            self.add_extension_property(GROUP_DIR_OBJ, name, 'Group')
+        user_ids = []
+        for index in range(users):
+            user = {"displayName": f"User {index:07d}", "jobTitle": generator.choice(['Engineer', 'Manager', 'Analyst']),
+                    "userPrincipalName": f"User{index:07d}@mock.onmicrosoft.com"}
+            user["mail"] = user["userPrincipalName"]
+            for name in extension_names:
+                user[self.extension_name(USER_DIR_APP, name)] = f"{name} {index % 10}"
+            user_ids.append(self.create_user(user)["id"])
+        for index in range(groups):
+            group = self.create_group({"displayName": f"Group {index:05d}", "description": f"Seeded group {index}"})
+            for user_id in generator.sample(user_ids, min(members_per_group, len(user_ids))):
+                self.add_member(group["id"], user_id)
+        return self
+
+    @staticmethod
+    def extension_name(app_id: str, name: str):
+        return f"extension_{app_id.replace('-', '')}_{name.replace(' ', '_')}"
+
+    def _change(self, resource: str, object_id: str, member_id: str = None, removed: bool = False):
+        self.sequence += 1
+        self.version += 1
+        self.log.append((self.sequence, resource, object_id, member_id, removed))
+
+    # Writes
+
+    def add_extension_property(self, object_id: str, name: str, target: str):
+        app_id = self.applications.get(object_id)
+        if app_id is None:
+            return None
+        raw_name = self.extension_name(app_id, name)
+        for value in self.extension_properties.values():
+            if value["name"] == raw_name:
+                return None
+        value = {"id": str(uuid.uuid4()), "name": raw_name, "dataType": "String", "targetObjects": [target],
+                 "isSyncedFromOnPremises": False, "appDisplayName": f"app {app_id}"}
+        self.extension_properties[value["id"]] = value
+        return value
+
+    def create_user(self, body: dict):
+        user = {key: value for key, value in body.items() if key not in ('passwordProfile', 'accountEnabled')}
+        user["id"] = body.get("id") or str(uuid.uuid4())
+        self.users[user["id"]] = user
+        if user.get("userPrincipalName"):
+            self.user_names[user["userPrincipalName"].lower()] = user["id"]
+        self.member_of[user["id"]] = {}
+        self._change('users', user["id"])
+        return user
+
+    def create_group(self, body: dict):
+        group = dict(body)
+        group["id"] = body.get("id") or str(uuid.uuid4())
+        self.groups[group["id"]] = group
+        self.members[group["id"]] = {}
+        self._change('groups', group["id"])
+        return group
+
+    def add_member(self, group_id: str, member_id: str):
+        self.members[group_id][member_id] = None
+        self.member_of.setdefault(member_id, {})[group_id] = None
+        self._change('groups', group_id, member_id)
+
+    def remove_member(self, group_id: str, member_id: str):
+        del self.members[group_id][member_id]
+        self.member_of.get(member_id, {}).pop(group_id, None)
+        self._change('groups', group_id, member_id, removed=True)
+
+    # Reads
+
+    def find_user(self, key: str):
+        user_id = key if key in self.users else self.user_names.get(key.lower())
+        return self.users.get(user_id) if user_id else None
+
+    def object_type(self, object_id: str):
+        return GROUP_TYPE if object_id in self.groups else USER_TYPE
+
+    def directory_object(self, object_id: str):
+        value = self.users.get(object_id) or self.groups.get(object_id) or {"id": object_id}
+        return {"@odata.type": self.object_type(object_id), **value}
+
+    @staticmethod
+    def project(value: dict, select):
+        if not select:
+            return dict(value)
+        projected = {key: value[key] for key in select if key in value}
+        projected["id"] = value["id"]
+        if "@odata.type" in value:
+            projected["@odata.type"] = value["@odata.type"]
+        return projected
+
+    def _sorted(self, resource: str, items: dict, orderby: str):
+        if not orderby:
+            return list(items.values())
+        key = (resource, orderby, self.version)
+        values = self.sorted_cache.get(key)
+        if values is None:
+            field, _, direction = orderby.partition(' ')
+            values = sorted(items.values(), key=lambda value: value.get(field) or '', reverse=direction == 'desc')
+            self.sorted_cache = {key: values}
+        return values
+
+    # Apply $filter and $search. Returns (values, None) or (None, error response) like Graph for queries
+    # that are invalid or need ConsistencyLevel: eventual without sending it
+
+    def matching(self, params: dict, headers: dict, values: list):
+        if '$filter' not in params and '$search' not in params:
+            return values, None
+        eventual = {key.lower(): value for key, value in headers.items()}.get('consistencylevel') == 'eventual'
+        predicates = []
+        advanced = '$search' in params or '$orderby' in params and '$filter' in params
+        try:
+            if '$filter' in params:
+                parser = FilterParser(params['$filter'])
+                predicates.append(parser.parse())
+                advanced = advanced or parser.advanced
+            if '$search' in params:
+                predicates.append(search_predicate(params['$search']))
+        except ValueError as invalid:
+            return None, error(400, 'Request_BadRequest', str(invalid))
+        if advanced and not eventual:
+            return None, error(400, 'Request_UnsupportedQuery',
+                               'This query requires the ConsistencyLevel header set to eventual')
+        return [value for value in values if all(predicate(value) for predicate in predicates)], None
+
+    def page(self, path: str, params: dict, values: list, extra=None):
+        top = min(int(params.get('$top', self.page_size)), 999)
+        skip = int(params.get('$skiptoken', 0))
+        select = [value for value in params.get('$select', '').split(',') if value]
+        body = {"@odata.context": f"{MOCK_URL}/$metadata#{path.strip('/')}"}
+        if params.get('$count') == 'true':
+            body["@odata.count"] = len(values)
+        if skip + top < len(values):
+            next_params = dict(params, **{'$skiptoken': str(skip + top)})
+            body["@odata.nextLink"] = f"{MOCK_URL}{path}?{urlencode(next_params)}"
+        body["value"] = [self.project(value, select) for value in values[skip:skip + top]]
+        if extra:
+            body.update(extra)
+        return 200, {}, body
+
+    # Delta: the token is the change sequence number the client has seen
+
+    def delta(self, resource: str, path: str, params: dict):
+        items = self.users if resource == 'users' else self.groups
+        select = [value for value in params.get('$select', '').split(',') if value]
+        with_members = resource == 'groups' and 'members' in select
+        # Like Graph, the delta link remembers the $select of the initial request
+        delta_link = f"{MOCK_URL}{path}?" + urlencode({'$select': params.get('$select', ''), '$deltatoken': self.sequence})
+        token = params.get('$deltatoken')
+        if token is None:
+            values = list(items.values())
+            if with_members:
+                values = [dict(value, **{"members@delta": [
+                    {"@odata.type": self.object_type(member_id), "id": member_id}
+                    for member_id in self.members[value["id"]]]}) for value in values]
+            select = select + ['members@delta'] if with_members else select
+            status, headers, body = self.page(path, dict(params, **{'$select': ','.join(select)}), values)
+            if "@odata.nextLink" not in body:
+                body["@odata.deltaLink"] = delta_link
+            return status, headers, body
+        token = int(token)
+        if token <= self.delta_horizon:
+            return error(410, 'syncStateNotFound', 'The delta token has expired, a full resync is required')
+        changed = {}
+        for sequence, log_resource, object_id, member_id, removed in self.log[token:]:
+            if log_resource != resource:
+                continue
+            entry = changed.setdefault(object_id, {})
+            if member_id is not None:
+                entry[member_id] = removed
+        values = []
+        for object_id, member_changes in changed.items():
+            if object_id not in items:
+                values.append({"id": object_id, "@removed": {"reason": "deleted"}})
+                continue
+            value = self.project(items[object_id], [key for key in select if key != 'members'])
+            if with_members and member_changes:
+                value["members@delta"] = [
+                    dict({"@odata.type": self.object_type(member_id), "id": member_id},
+                         **({"@removed": {"reason": "deleted"}} if removed else {}))
+                    for member_id, removed in member_changes.items()]
+            values.append(value)
+        return 200, {}, {"@odata.context": f"{MOCK_URL}/$metadata#{resource}",
+                         "@odata.deltaLink": delta_link, "value": values}
+
+    # Tokens issued before this call answer 410, forcing clients into a full resync
+
+    def expire_delta_tokens(self):
+        self.delta_horizon = self.sequence
+
+    def handle(self, method: str, url: str, body=None, headers=None):
+        parts = urlsplit(url)
+        path = unquote(parts.path)
+        if path.startswith('/v1.0'):
+            path = path[len('/v1.0'):]
+        params = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        segments = [segment for segment in path.split('/') if segment]
+        try:
+            return self.route(method.upper(), path, segments, params, body, headers or {})
+        except KeyError as missing:
+            return error(404, 'Request_ResourceNotFound', f"Resource {missing} does not exist")
+
+    def route(self, method: str, path: str, segments: list, params: dict, body, headers: dict):
+        if segments == ['$batch'] and method == 'POST':
+            return self.batch(body)
+        if segments == ['directoryObjects', 'getAvailableExtensionProperties'] and method == 'POST':
+            return 200, {}, {"value": list(self.extension_properties.values())}
+        if segments and segments[0] == 'applications' and len(segments) >= 3 and segments[2] == 'extensionProperties':
+            if method == 'POST' and len(segments) == 3:
+                value = self.add_extension_property(segments[1], body["name"], body["targetObjects"][0])
+                if value is None:
+                    return error(400, 'Request_BadRequest', 'Property already exists or application not found')
+                return 201, {}, value
+            if method == 'DELETE' and len(segments) == 4:
+                del self.extension_properties[segments[3]]
+                return 204, {}, None
+        if not segments or segments[0] not in ('users', 'groups'):
+            return error(400, 'BadRequest', f"Unsupported request {method} {path}")
+        resource = segments[0]
+        items = self.users if resource == 'users' else self.groups
+        if len(segments) == 1:
+            if method == 'GET':
+                values, failure = self.matching(params, headers, self._sorted(resource, items, params.get('$orderby')))
+                return failure or self.page(path, params, values)
+            if method == 'POST':
+                if resource == 'users':
+                    if (body.get("userPrincipalName") or '').lower() in self.user_names:
+                        return error(400, 'Request_BadRequest', 'Another object with the same value for property '
+                                                                'userPrincipalName already exists.')
+                    return 201, {}, self.create_user(body)
+                return 201, {}, self.create_group(body)
+        if segments[1] == 'delta' and method == 'GET':
+            return self.delta(resource, path, params)
+        if segments[1] == '$count' and method == 'GET':
+            return 200, {'Content-Type': 'text/plain'}, str(len(items))
+        value = self.find_user(segments[1]) if resource == 'users' else self.groups.get(segments[1])
+        if value is None:
+            raise KeyError(segments[1])
+        object_id = value["id"]
+        if len(segments) == 2:
+            if method == 'GET':
+                select = [key for key in params.get('$select', '').split(',') if key]
+                return 200, {}, dict(self.project(value, select), **{"@odata.context": f"{MOCK_URL}/$metadata"})
+            if method == 'PATCH':
+                for key, new_value in body.items():
+                    if new_value is None:
+                        value.pop(key, None)
+                    else:
+                        value[key] = new_value
+                self._change(resource, object_id)
+                return 204, {}, None
+            if method == 'DELETE':
+                del items[object_id]
+                if resource == 'users':
+                    self.user_names.pop((value.get("userPrincipalName") or '').lower(), None)
+                for group_id in list(self.member_of.pop(object_id, {})):
+                    self.remove_member(group_id, object_id)
+                for member_id in list(self.members.pop(object_id, {})) if resource == 'groups' else []:
+                    self.member_of.get(member_id, {}).pop(object_id, None)
+                self._change(resource, object_id)
+                return 204, {}, None
+        if resource == 'users' and segments[2] == 'memberOf' and method == 'GET':
+            groups = [dict(self.groups[group_id], **{"@odata.type": GROUP_TYPE}) for group_id in self.member_of.get(object_id, {})]
+            groups, failure = self.matching(params, headers, groups)
+            return failure or self.page(path, params, groups)
+        if resource == 'groups' and segments[2] == 'members':
+            if len(segments) == 3 and method == 'GET':
+                members = [self.directory_object(member_id) for member_id in self.members[object_id]]
+                members, failure = self.matching(params, headers, members)
+                return failure or self.page(path, params, members)
+            if segments[3:] == ['microsoft.graph.user'] and method == 'GET':
+                members = [self.directory_object(member_id) for member_id in self.members[object_id] if member_id in self.users]
+                members, failure = self.matching(params, headers, members)
+                return failure or self.page(path, params, members)
+            if segments[3:] == ['$ref'] and method == 'POST':
+                member_id = body["@odata.id"].rstrip('/').split('/')[-1]
+                if member_id not in self.users and member_id not in self.groups:
+                    raise KeyError(member_id)
+                if member_id in self.members[object_id]:
+                    return error(400, 'Request_BadRequest', 'One or more added object references already exist')
+                self.add_member(object_id, member_id)
+                return 204, {}, None
+            if len(segments) == 5 and segments[4] == '$ref' and method == 'DELETE':
+                if segments[3] not in self.members[object_id]:
+                    raise KeyError(segments[3])
+                self.remove_member(object_id, segments[3])
+                return 204, {}, None
+        return error(400, 'BadRequest', f"Unsupported request {method} {path}")
+
+    def batch(self, body: dict, throttle_rate: float = 0.0):
+        if len(body["requests"]) > 20:
+            return error(400, 'BadRequest', 'A maximum of 20 requests is allowed in a batch')
+        responses = []
+        statuses = {}
+        for request in body["requests"]:
+            self.sub_requests += 1
+            if any(statuses.get(dependency, 500) >= 400 for dependency in request.get("dependsOn", [])):
+                status, headers, response_body = error(424, 'FailedDependency', 'A dependency failed')
+            elif throttle_rate and random.random() < throttle_rate:
+                status, headers, response_body = error(429, 'TooManyRequests', 'Throttled')
+                headers = {"Retry-After": "1"}
+            else:
+                status, headers, response_body = self.handle(request["method"], request["url"], request.get("body"),
+                                                             request.get("headers"))
+            statuses[request["id"]] = status
+            response = {"id": request["id"], "status": status, "headers": headers}
+            if response_body is not None:
+                response["body"] = response_body
+            responses.append(response)
+        return 200, {}, {"responses": responses}
+
+
+def encode(status: int, headers: dict, body):
+    headers = dict(headers)
+    if body is None:
+        return status, headers, b''
+    if isinstance(body, str):
+        headers.setdefault('Content-Type', 'text/plain')
+        return status, headers, body.encode('utf-8')
+    headers.setdefault('Content-Type', 'application/json')
+    return status, headers, json.dumps(body).encode('utf-8')
+
+
+# httpx transport answering from a MockGraph, with injectable latency and 429s.
+# Pass it to GraphClient(settings, transport=MockGraphTransport(graph), credential=StaticTokenCredential()).
+
+class MockGraphTransport(httpx.AsyncBaseTransport):
+    def __init__(self, graph: MockGraph, latency: float = 0.0, jitter: float = 0.0, throttle_rate: float = 0.0,
+                 retry_after: float = 1.0):
+        self.graph = graph
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        content = await request.aread()
+        self.graph.requests += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            status, headers, body = error(429, 'TooManyRequests', 'Throttled by the mock')
+            headers = {"Retry-After": str(self.retry_after)}
+        else:
+            body = json.loads(content) if content else None
+            if request.url.path.endswith('/$batch'):
+                status, headers, body = self.graph.batch(body, self.throttle_rate)
+            else:
+                status, headers, body = self.graph.handle(request.method, str(request.url), body, dict(request.headers))
+        status, headers, content = encode(status, headers, body)
+        return httpx.Response(status, headers=headers, content=content, request=request)
+
+
+# Serve a MockGraph over plain HTTP, for tools outside this process (Requests go to http://host:port/v1.0/...)
+
+def serve(graph: MockGraph, host: str = '127.0.0.1', port: int = 8080):
+    class Handler(BaseHTTPRequestHandler):
+        def _answer(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            content = self.rfile.read(length) if length else b''
+            body = json.loads(content) if content else None
+            graph.requests += 1
+            status, headers, response = encode(*graph.handle(self.command, self.path, body, dict(self.headers)))
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header('Content-Length', str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        do_GET = do_POST = do_PATCH = do_DELETE = _answer
+
+    HTTPServer((host, port), Handler).serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for Microsoft Graph")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=50)
+    parser.add_argument('--members', type=int, default=20)
+    args = parser.parse_args()
+    serve(MockGraph().seed(args.users, args.groups, args.members, ['Domicile', 'Cost Center']), port=args.port)
@@ -0,0 +1,183 @@
+import asyncio
+import configparser
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import httpx
+from configuration import load_config
+from instrumentation import Instrumentation
+
+TENANT_PREFIX = 'tenant:'
+
+
+# Tenant sections of the config files: [tenant:contoso], [tenant:fabrikam], ... with the same keys as [azure].
+# Settings shared by every tenant (rate limits, pool sizes) go in [DEFAULT].
+# Returns {tenant name: settings dict}, plain dicts so they can be sent to worker processes.
+
+def load_tenants(paths=('config.cfg', 'config.dev.cfg'), names: list = None):
+    config = load_config(tuple(paths))
+    tenants = {}
+    for section in config.sections():
+        if not section.startswith(TENANT_PREFIX):
+            continue
+        name = section[len(TENANT_PREFIX):]
+        if names is None or name in names:
+            tenants[name] = dict(config[section])
+    if names is not None:
+        missing = set(names) - set(tenants)
+        if missing:
+            raise KeyError(f"No [{TENANT_PREFIX}...] section for {', '.join(sorted(missing))}")
+    return tenants
+
+
+def tenant_section(name: str, settings: dict):
+    config = configparser.ConfigParser()
+    config[TENANT_PREFIX + name] = settings
+    return config[TENANT_PREFIX + name]
+
+
+# Jobs run inside a worker, once per tenant: async job(graph_client, tenant, options) -> JSON serializable result
+
+async def export_job(graph_client, tenant: str, options: dict):
+    from export import DirectoryExporter
+    exporter = DirectoryExporter(graph_client, os.path.join(options.get('output') or 'exports', tenant),
+                                 format=options.get('format') or 'jsonl', compression=options.get('compression'))
+    return await exporter.export()
+
+
+async def delta_job(graph_client, tenant: str, options: dict):
+    from mirror import DirectoryMirror
+    directory = options.get('output') or 'mirrors'
+    os.makedirs(directory, exist_ok=True)
+    mirror = DirectoryMirror(graph_client, os.path.join(directory, f"{tenant}.sqlite3"))
+    try:
+        return {"events": await mirror.refresh()}
+    finally:
+        mirror.close()
+
+
+async def provision_job(graph_client, tenant: str, options: dict):
+    from provisioning import BulkProvisioner, read_user_records
+    from users import Users
+    directory = options.get('output') or 'provisioned'
+    os.makedirs(directory, exist_ok=True)
+    provisioner = BulkProvisioner(Users(graph_client.settings, graph_client), concurrency=options.get('concurrency', 16))
+    records = read_user_records(options['input'].format(tenant=tenant))
+    return await provisioner.provision(records, os.path.join(directory, f"{tenant}.jsonl"))
+
+
+JOBS = {
+    'export': export_job,
+    'delta': delta_job,
+    'provision': provision_job,
+}
+
+
+# Connection pool shared by every tenant of a worker. Closing one tenant's GraphClient leaves it open.
+
+class SharedTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        pass
+
+
+# Worker process state: one event loop and one connection pool, kept across the shards the worker runs
+
+_worker = {}
+
+
+def _init_worker():
+    _worker['loop'] = asyncio.new_event_loop()
+    asyncio.set_event_loop(_worker['loop'])
+
+
+def _shared_transport(config):
+    transport = _worker.get('transport')
+    if transport is None:
+        limits = httpx.Limits(
+            max_connections=config.getint('maxConnections', fallback=100),
+            max_keepalive_connections=config.getint('maxKeepaliveConnections', fallback=20),
+            keepalive_expiry=config.getfloat('keepaliveExpiry', fallback=30.0),
+        )
+        transport = SharedTransport(httpx.AsyncHTTPTransport(http2=config.getboolean('http2', fallback=True),
+                                                             limits=limits))
+        _worker['transport'] = transport
+    return transport
+
+
+async def _run_tenant(job: str, name: str, settings: dict, options: dict):
+    from client import GraphClient
+    started = time.perf_counter()
+    outcome = {"tenant": name, "job": job, "result": None, "error": None, "endpoints": {}}
+    graph_client = None
+    try:
+        # A tenant section with a missing or bad setting fails that tenant only, not its shard
+        config = tenant_section(name, settings)
+        # Each tenant keeps its own credential and rate limits (throttling is per tenant id) on the shared pool
+        graph_client = GraphClient(config, transport=_shared_transport(config))
+        outcome["result"] = await JOBS[job](graph_client, name, options)
+    except Exception as error:
+        outcome["error"] = f"{type(error).__name__}: {error}"
+    finally:
+        if graph_client is not None:
+            await graph_client.close()
+            outcome["endpoints"] = graph_client.instrumentation.endpoints
+    outcome["seconds"] = round(time.perf_counter() - started, 3)
+    return outcome
+
+
+async def _run_tenants(job: str, shard: list, options: dict):
+    return await asyncio.gather(*(_run_tenant(job, name, settings, options) for name, settings in shard))
+
+
+def _run_shard(job: str, shard: list, options: dict):
+    if 'loop' not in _worker:
+        _init_worker()
+    return _worker['loop'].run_until_complete(_run_tenants(job, shard, options))
+
+
+# Runs one job for many tenants on a process pool. Tenants are cut into shards of shard_size that run
+# concurrently on a worker's event loop; there are more shards than workers, so a worker that finishes
+# early picks up the next shard. Per tenant results and the merged Graph metrics come back to the parent.
+
+class MultiTenantRunner:
+    def __init__(self, tenants: dict, workers: int = None, shard_size: int = 8):
+        self.tenants = tenants
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_size = max(1, shard_size)
+        self.instrumentation = Instrumentation()
+
+    def shards(self):
+        items = list(self.tenants.items())
+        return [items[start:start + self.shard_size] for start in range(0, len(items), self.shard_size)]
+
+    # Returns {"tenants": [per tenant result], "summary": {...}, "endpoints": merged instrumentation summary}
+
+    async def run(self, job: str, options: dict = None):
+        if job not in JOBS:
+            raise ValueError(f"Unknown job {job!r}, expected one of {', '.join(JOBS)}")
+        options = options or {}
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker) as executor:
+            shards = await asyncio.gather(*(loop.run_in_executor(executor, _run_shard, job, shard, options)
+                                            for shard in self.shards()))
+        results = []
+        for outcome in (outcome for shard in shards for outcome in shard):
+            self.instrumentation.merge(outcome.pop("endpoints"))
+            results.append(outcome)
+        failed = [outcome["tenant"] for outcome in results if outcome["error"]]
+        summary = {
+            "job": job,
+            "tenants": len(results),
+            "failed": len(failed),
+            "failed_tenants": failed,
+            "seconds": round(time.perf_counter() - started, 3),
+            "workers": self.workers,
+        }
+        return {"tenants": results, "summary": summary, "endpoints": self.instrumentation.summary()}
@@ -0,0 +1,54 @@
+import asyncio
+import functools
+
+
+# Kiota error mapping, built on first use so that importing paging does not load the generated models
+
+@functools.lru_cache(maxsize=None)
+def error_mapping():
+    from msgraph.generated.models.o_data_errors.o_data_error import ODataError
+    return {
+        "4XX": ODataError,
+        "5XX": ODataError,
+    }
+
+# Follow @odata.nextLink across every page of a collection request and yield the items one by one.
+# The request for the next page is sent before the items of the current page are handed out,
+# so the caller's processing overlaps with the network round trip of the following page.
+# Only one page is held in memory at a time.
+
+async def iterate_pages(request_adapter, request_info, response_type):
+    pending = asyncio.ensure_future(request_adapter.send_async(request_info, response_type, error_mapping()))
+    try:
+        while pending is not None:
+            page = await pending
+            pending = None
+            if page is None:
+                break
+            next_link = page.odata_next_link
+            if next_link:
+                request_info.url = next_link  # nextLink already carries $select, $top and the skiptoken
+                pending = asyncio.ensure_future(request_adapter.send_async(request_info, response_type, error_mapping()))
+            for item in page.value or []:
+                yield item
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+# Same as iterate_pages for raw JSON requests sent through GraphClient.send_json.
+# Yields whole page dicts so callers can read @odata.deltaLink or other annotations from the last page.
+
+async def iterate_raw_pages(graph_client, url: str, headers=None):
+    pending = asyncio.ensure_future(graph_client.send_json("GET", url, headers=headers))
+    try:
+        while pending is not None:
+            page = await pending
+            pending = None
+            next_link = page.get("@odata.nextLink")
+            if next_link:
+                pending = asyncio.ensure_future(graph_client.send_json("GET", next_link, headers=headers))
+            yield page
+    finally:
+        if pending is not None:
+            pending.cancel()
@@ -0,0 +1,138 @@
+import asyncio
+import csv
+import json
+import os
+from urllib.parse import quote
+from users import Users, DEFAULT_DOMAIN, user_principal_name
+
+# Record keys that map to standard user properties. Every other non-empty key is a directory extension property
+STANDARD_KEYS = {'Name', 'JobTitle'}
+
+
+# Read user records lazily from a .csv (header row required) or .jsonl file.
+# Extension values can be given as extra columns / keys or, in JSONL, as a nested "properties" dictionary.
+
+def read_user_records(path: str):
+    if path.endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                yield row
+    else:
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def split_record(record: dict):
+    user_properties = {key: record[key] for key in STANDARD_KEYS if record.get(key)}
+    extensions = dict(record.get('properties') or {})
+    for key, value in record.items():
+        if key not in STANDARD_KEYS and key != 'properties' and value not in (None, ''):
+            extensions[key] = value
+    return user_properties, extensions
+
+
+# Append-only log of the user principal names a run has started and finished.
+# A name that was started but never finished may or may not have been created before a crash,
+# so on resume it is looked up before creating it again.
+
+class ProvisioningCheckpoint:
+    def __init__(self, path: str):
+        self.path = path
+        self.started = set()
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    (self.done if entry['state'] == 'done' else self.started).add(entry['upn'])
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def in_doubt(self, upn: str):
+        return upn in self.started and upn not in self.done
+
+    def mark(self, upn: str, state: str):
+        self.file.write(json.dumps({"upn": upn, "state": state}) + "\n")
+        self.file.flush()
+        (self.done if state == 'done' else self.started).add(upn)
+
+    def close(self):
+        self.file.close()
+
+
+# Creates users from a stream of records with at most `concurrency` requests in flight.
+# Each result line (UPN, id, one-time password or error) is appended to the output JSONL file as soon as it is known.
+
+class BulkProvisioner:
+    def __init__(self, users: Users, concurrency: int = 16):
+        self.users = users
+        self.concurrency = concurrency
+        self.domain = users.settings.get('domain') or DEFAULT_DOMAIN
+
+    async def _exists(self, upn: str):
+        response = await self.users.graph_client.send("GET", f"/users/{quote(upn)}?$select=id")
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()['id']
+
+    # A record that cannot be read (e.g. no Name) is reported as failed like any other error, it never stops a worker
+
+    async def _provision_one(self, record: dict, checkpoint: ProvisioningCheckpoint):
+        upn = None
+        try:
+            user_properties, extensions = split_record(record)
+            if not user_properties.get('Name'):
+                raise ValueError(f"Record has no Name: {record!r}")
+            upn = user_principal_name(user_properties['Name'], self.domain)
+            if upn in checkpoint.done:
+                return None
+            if checkpoint.in_doubt(upn):
+                user_id = await self._exists(upn)
+                if user_id is not None:
+                    return {"upn": upn, "id": user_id, "status": "exists"}
+            checkpoint.mark(upn, 'started')
+            password, mail, user_id = await self.users.user_creation_singular(user_properties, extensions)
+        except Exception as error:
+            return {"upn": upn, "status": "failed", "error": str(error)}
+        return {"upn": mail, "id": user_id, "password": password, "status": "created"}
+
+    # Returns the number of records per status (created, exists, failed, skipped)
+
+    async def provision(self, records, output_path: str, checkpoint_path: str = None):
+        checkpoint = ProvisioningCheckpoint(checkpoint_path or output_path + '.checkpoint')
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        summary = {"created": 0, "exists": 0, "failed": 0, "skipped": 0}
+
+        with open(output_path, 'a', encoding='utf-8') as output:
+            async def worker():
+                while True:
+                    record = await queue.get()
+                    if record is None:
+                        return
+                    result = await self._provision_one(record, checkpoint)
+                    if result is None:
+                        summary["skipped"] += 1
+                        continue
+                    summary[result["status"]] += 1
+                    output.write(json.dumps(result) + "\n")
+                    output.flush()
+                    # Only after the password is on disk, so a crash can never lose it
+                    if result["status"] != "failed":
+                        checkpoint.mark(result["upn"], 'done')
+
+            workers = [asyncio.ensure_future(worker()) for _ in range(self.concurrency)]
+            try:
+                for record in records:
+                    await queue.put(record)
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+            finally:
+                for task in workers:
+                    task.cancel()
+                checkpoint.close()
+        return summary
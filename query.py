@@ -0,0 +1,212 @@
+import datetime
+from urllib.parse import quote, urlencode
+from paging import iterate_raw_pages
+
+# Characters left as they are in the query string, Graph reads $filter=startswith(displayName,'A') unencoded
+URL_SAFE = ",()$'"
+
+
+# OData literal for a Python value ('O''Brien', true, null, 42, 2024-01-31T00:00:00Z)
+
+def literal(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value.isoformat(timespec='seconds') + 'Z'
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+# A $filter expression. Combine with & (and), | (or) and ~ (not).
+# advanced is set when Graph only accepts the expression as an advanced query (ConsistencyLevel: eventual)
+# render receives a function that turns a readable extension name into its extension_<appid>_ name
+
+class Condition:
+    def __init__(self, render, advanced: bool = False):
+        self.render = render
+        self.advanced = advanced
+
+    def __and__(self, other):
+        return Condition(lambda resolve: f"({self.render(resolve)} and {other.render(resolve)})",
+                         self.advanced or other.advanced)
+
+    def __or__(self, other):
+        return Condition(lambda resolve: f"({self.render(resolve)} or {other.render(resolve)})",
+                         self.advanced or other.advanced)
+
+    def __invert__(self):
+        return Condition(lambda resolve: f"not ({self.render(resolve)})", True)
+
+
+# A property to filter on: Field('displayName') == 'Alice', Field('jobTitle').startswith('Eng'),
+# extension('Domicile').in_(['Oslo', 'Bergen'])
+
+class Field:
+    def __init__(self, name: str, extension: bool = False):
+        self.name = name
+        self.extension = extension
+
+    def _name(self, resolve):
+        return resolve(self.name) if self.extension else self.name
+
+    def _compare(self, operator: str, value, advanced: bool = False):
+        return Condition(lambda resolve: f"{self._name(resolve)} {operator} {literal(value)}",
+                         advanced or self.extension)
+
+    def __eq__(self, value):
+        return self._compare('eq', value)
+
+    def __ne__(self, value):
+        return self._compare('ne', value, advanced=True)
+
+    def __lt__(self, value):
+        return self._compare('lt', value)
+
+    def __le__(self, value):
+        return self._compare('le', value)
+
+    def __gt__(self, value):
+        return self._compare('gt', value)
+
+    def __ge__(self, value):
+        return self._compare('ge', value)
+
+    __hash__ = None
+
+    def startswith(self, value: str):
+        return Condition(lambda resolve: f"startswith({self._name(resolve)},{literal(value)})", self.extension)
+
+    def endswith(self, value: str):
+        return Condition(lambda resolve: f"endswith({self._name(resolve)},{literal(value)})", True)
+
+    def in_(self, values):
+        values = list(values)
+        return Condition(lambda resolve: f"{self._name(resolve)} in ({','.join(literal(value) for value in values)})",
+                         self.extension)
+
+
+def extension(name: str):
+    return Field(name, extension=True)
+
+
+# Builds one Graph collection request and streams its results. Every method returns the query, so calls chain:
+#   users.query().filter(Field('jobTitle') == 'Engineer', extension('Domicile') == 'Oslo').select(extensions=['Domicile'])
+# Extension names (readable or extension_...) are resolved through the cached extension schema of app_setting.
+# ConsistencyLevel: eventual and $count=true are added whenever the query needs Graph's advanced query support.
+
+class Query:
+    def __init__(self, graph_client, path: str, app_setting: str, select: list, advanced: bool = False):
+        self.graph_client = graph_client
+        self.path = path
+        self.app_setting = app_setting
+        self.selected = list(select)
+        self.extensions = []
+        self.conditions = []
+        self.searches = []
+        self.order = None
+        self.page_size = None
+        self.maximum = None
+        self.advanced = advanced
+
+    # Conditions (Condition objects or raw $filter strings) are joined with "and"
+
+    def filter(self, *conditions):
+        self.conditions.extend(conditions)
+        return self
+
+    # $search on one property, e.g. search('displayName', 'ali'). Several searches are joined with AND
+
+    def search(self, property_name: str, text: str):
+        self.searches.append(f'"{property_name}:{text.replace(chr(34), "")}"')
+        self.advanced = True
+        return self
+
+    # Additional properties, extension properties by readable name
+
+    def select(self, *names, extensions: list = None):
+        self.selected.extend(names)
+        self.extensions.extend(extensions or [])
+        return self
+
+    def orderby(self, property_name: str, descending: bool = False):
+        self.order = f"{property_name} desc" if descending else property_name
+        return self
+
+    # $top, the page size (Maximum 999)
+
+    def top(self, page_size: int):
+        self.page_size = page_size
+        return self
+
+    # Stop after this many results
+
+    def limit(self, count: int):
+        self.maximum = count
+        return self
+
+    def is_advanced(self):
+        if self.advanced or self.searches:
+            return True
+        if any(isinstance(condition, Condition) and condition.advanced for condition in self.conditions):
+            return True
+        # Sorting a filtered result is only supported as an advanced query
+        return bool(self.order and self.conditions)
+
+    async def _schema(self):
+        return await self.graph_client.extension_schemas.get(self.graph_client.settings[self.app_setting])
+
+    # (url, headers) of the first page
+
+    async def build(self, count_only: bool = False):
+        schema = await self._schema()
+        params = {}
+        if self.conditions:
+            parts = [condition if isinstance(condition, str) else condition.render(schema.to_raw)
+                     for condition in self.conditions]
+            params['$filter'] = ' and '.join(parts)
+        if self.searches:
+            params['$search'] = ' AND '.join(self.searches)
+        if count_only:
+            params['$select'] = 'id'
+            params['$top'] = 1
+        else:
+            params['$select'] = ','.join(self.selected + [schema.to_raw(name) for name in self.extensions])
+            if self.order:
+                params['$orderby'] = self.order
+            if self.page_size:
+                params['$top'] = self.page_size
+        headers = None
+        if count_only or self.is_advanced():
+            params['$count'] = 'true'
+            headers = {'ConsistencyLevel': 'eventual'}
+        return f"{self.path}?{urlencode(params, quote_via=quote, safe=URL_SAFE)}", headers
+
+    # Number of matching objects, one request
+
+    async def count(self):
+        url, headers = await self.build(count_only=True)
+        page = await self.graph_client.send_json("GET", url, headers=headers)
+        return page.get('@odata.count', 0)
+
+    # Stream the matching objects as dicts (Graph property names, extension_... keys for extensions)
+
+    async def __aiter__(self):
+        url, headers = await self.build()
+        remaining = self.maximum
+        async for page in iterate_raw_pages(self.graph_client, url, headers):
+            for value in page.get('value', []):
+                if remaining is not None:
+                    if remaining <= 0:
+                        return
+                    remaining -= 1
+                yield value
+            if remaining is not None and remaining <= 0:
+                return
+
+    async def all(self):
+        return [value async for value in self]
@@ -0,0 +1,191 @@
+import asyncio
+import json
+from batching import GraphBatch, batch_get_all
+from client import GRAPH_URL
+
+RESOURCES = ('users', 'groups')
+SETTINGS = {'users': 'user_dir_app', 'groups': 'group_dir_app'}
+
+
+# Desired state of existing users and groups, keyed by object id (users also by user principal name):
+#   {
+#     "users":  {"<id>": {"properties": {"jobTitle": "Engineer"}, "extensions": {"Domicile": "Oslo"}}},
+#     "groups": {"<id>": {"properties": {"description": "..."}, "extensions": {...}, "members": ["<member id>", ...]}}
+#   }
+# Only the properties and extensions listed are compared, a value of None clears the property.
+# "members" is the complete list of direct members; members not listed are removed unless prune is off.
+
+def load_desired_state(path: str):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+# True and 1 compare equal in Python but not in Graph
+
+def _same(current, desired):
+    return current == desired and type(current) is type(desired)
+
+
+def _public(operation: dict):
+    return {key: value for key, value in operation.items() if key != 'raw_changes'}
+
+
+# The operations needed to reach the desired state, printable as a dry run:
+#   {"action": "update", "resource": ..., "id": ..., "changes": {name: {"from": old, "to": new}}}
+#   {"action": "add_member" | "remove_member", "resource": "groups", "id": group id, "member_id": ...}
+# errors lists the objects that could not be read (Not found, no permission), they are left alone.
+
+class Plan:
+    def __init__(self):
+        self.operations = []
+        self.errors = []
+        self.unchanged = 0
+
+    def __len__(self):
+        return len(self.operations)
+
+    def summary(self):
+        counts = {"update": 0, "add_member": 0, "remove_member": 0}
+        for operation in self.operations:
+            counts[operation["action"]] += 1
+        return {**counts, "unchanged": self.unchanged, "errors": len(self.errors)}
+
+    def to_dict(self):
+        return {"summary": self.summary(), "operations": [_public(operation) for operation in self.operations],
+                "errors": self.errors}
+
+    def report(self):
+        lines = []
+        for operation in self.operations:
+            target = f"{operation['resource']}/{operation['id']}"
+            if operation["action"] == 'update':
+                for name, change in operation["changes"].items():
+                    lines.append(f"~ {target} {name}: {change['from']!r} -> {change['to']!r}")
+            elif operation["action"] == 'add_member':
+                lines.append(f"+ {target} member {operation['member_id']}")
+            else:
+                lines.append(f"- {target} member {operation['member_id']}")
+        for error in self.errors:
+            lines.append(f"! {error['resource']}/{error['id']}: {error['error']}")
+        summary = self.summary()
+        lines.append(", ".join(f"{count} {name}" for name, count in summary.items()))
+        return "\n".join(lines)
+
+
+def _request(operation: dict):
+    path = f"/{operation['resource']}/{operation['id']}"
+    if operation["action"] == 'update':
+        return "PATCH", path, {name: change["to"] for name, change in operation["raw_changes"].items()}
+    if operation["action"] == 'add_member':
+        return "POST", f"{path}/members/$ref", {"@odata.id": f"{GRAPH_URL}/directoryObjects/{operation['member_id']}"}
+    return "DELETE", f"{path}/members/{operation['member_id']}/$ref", None
+
+
+# Brings users and groups to a desired state with as few writes as possible.
+# The current values are read 20 objects per $batch (only the properties named in the desired state),
+# compared, and only the differences are written, again through $batch. Unchanged objects cost no write.
+
+class Reconciler:
+    def __init__(self, graph_client, prune: bool = True, max_concurrency: int = 4):
+        self.graph_client = graph_client
+        self.settings = graph_client.settings
+        self.prune = prune
+        self.max_concurrency = max_concurrency
+
+    async def _schemas(self):
+        registry = self.graph_client.extension_schemas
+        return {resource: await registry.get(self.settings[setting]) for resource, setting in SETTINGS.items()}
+
+    async def _current_objects(self, resource: str, desired: dict, schema):
+        batch = GraphBatch(self.graph_client, self.max_concurrency)
+        futures = {}
+        for object_id, state in desired.items():
+            names = ['id'] + list(state.get('properties', {})) + [schema.to_raw(name) for name in state.get('extensions', {})]
+            futures[object_id] = batch.add("GET", f"/{resource}/{object_id}?$select={','.join(names)}")
+        await batch.execute()
+        results = await asyncio.gather(*futures.values(), return_exceptions=True)
+        return dict(zip(futures, results))
+
+    async def _current_members(self, desired: dict):
+        urls = {group_id: f"/groups/{group_id}/members?$select=id&$top=999"
+                for group_id, state in desired.items() if 'members' in state}
+        return await batch_get_all(self.graph_client, urls, self.max_concurrency)
+
+    # Read the current state and compute the operations. Nothing is written
+
+    async def plan(self, desired: dict):
+        schemas = await self._schemas()
+        plan = Plan()
+        for resource in RESOURCES:
+            objects = desired.get(resource) or {}
+            if not objects:
+                continue
+            current = await self._current_objects(resource, objects, schemas[resource])
+            members = await self._current_members(objects) if resource == 'groups' else {}
+            for object_id, state in objects.items():
+                data = current[object_id]
+                if isinstance(data, Exception):
+                    plan.errors.append({"resource": resource, "id": object_id, "error": str(data)})
+                    continue
+                operations = self._diff(resource, object_id, state, data, members.get(object_id), schemas[resource], plan)
+                if operations:
+                    plan.operations.extend(operations)
+                else:
+                    plan.unchanged += 1
+        return plan
+
+    def _diff(self, resource: str, object_id: str, state: dict, data: dict, members, schema, plan: Plan):
+        operations = []
+        changes = {}
+        raw_changes = {}
+        wanted = [(name, name) for name in state.get('properties', {})]
+        wanted += [(name, schema.to_raw(name)) for name in state.get('extensions', {})]
+        values = {**state.get('properties', {}), **state.get('extensions', {})}
+        for name, raw_name in wanted:
+            if not _same(data.get(raw_name), values[name]):
+                changes[name] = {"from": data.get(raw_name), "to": values[name]}
+                raw_changes[raw_name] = changes[name]
+        if changes:
+            operations.append({"action": "update", "resource": resource, "id": object_id,
+                               "changes": changes, "raw_changes": raw_changes})
+        if 'members' not in state:
+            return operations
+        if isinstance(members, Exception):
+            plan.errors.append({"resource": resource, "id": object_id, "error": f"members: {members}"})
+            return operations
+        current_ids = {value["id"].lower(): value["id"] for value in members}
+        desired_ids = {member_id.lower(): member_id for member_id in state['members']}
+        for key, member_id in desired_ids.items():
+            if key not in current_ids:
+                operations.append({"action": "add_member", "resource": resource, "id": object_id, "member_id": member_id})
+        if self.prune:
+            for key, member_id in current_ids.items():
+                if key not in desired_ids:
+                    operations.append({"action": "remove_member", "resource": resource, "id": object_id,
+                                       "member_id": member_id})
+        return operations
+
+    # Write the operations of a plan. Returns {"applied": count, "failed": [operation with its error]}
+
+    async def apply(self, plan: Plan):
+        batch = GraphBatch(self.graph_client, self.max_concurrency)
+        futures = []
+        for operation in plan.operations:
+            method, url, body = _request(operation)
+            futures.append(batch.add(method, url, body))
+        await batch.execute()
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        failed = []
+        for operation, result in zip(plan.operations, results):
+            if isinstance(result, Exception):
+                failed.append({**_public(operation), "error": str(result)})
+        return {"applied": len(results) - len(failed), "failed": failed}
+
+    # Plan and, unless dry_run, apply. Returns the plan (as a dict) and the write results
+
+    async def reconcile(self, desired: dict, dry_run: bool = False):
+        plan = await self.plan(desired)
+        result = plan.to_dict()
+        if not dry_run and plan.operations:
+            result["result"] = await self.apply(plan)
+        return result
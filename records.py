@@ -0,0 +1,200 @@
+import asyncio
+import json
+import re
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_decoder = json.JSONDecoder()
+
+
+# Compact read-only records for the lightweight read mode. FIELDS are the Graph property names
+# in slot order, they double as the $select of the request.
+
+class Record:
+    __slots__ = ()
+    FIELDS = ()
+
+    @classmethod
+    def select(cls):
+        return ','.join(cls.FIELDS)
+
+    @classmethod
+    def from_json(cls, value: dict):
+        return cls(*map(value.get, cls.FIELDS))
+
+    def to_dict(self):
+        return {field: getattr(self, slot) for field, slot in zip(self.FIELDS, self.__slots__)}
+
+    def __eq__(self, other):
+        return type(other) is type(self) and all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __repr__(self):
+        values = ', '.join(f"{slot}={getattr(self, slot)!r}" for slot in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+
+class UserRecord(Record):
+    __slots__ = ('id', 'display_name', 'job_title')
+    FIELDS = ('id', 'displayName', 'jobTitle')
+
+    def __init__(self, id, display_name, job_title):
+        self.id = id
+        self.display_name = display_name
+        self.job_title = job_title
+
+
+class GroupRecord(Record):
+    __slots__ = ('id', 'display_name')
+    FIELDS = ('id', 'displayName')
+
+    def __init__(self, id, display_name):
+        self.id = id
+        self.display_name = display_name
+
+
+# Members of a group can be users, groups, devices or service principals. type is the @odata.type
+
+class MemberRecord(Record):
+    __slots__ = ('id', 'type', 'display_name', 'mail')
+    FIELDS = ('id', '@odata.type', 'displayName', 'mail')
+
+    def __init__(self, id, type, display_name, mail):
+        self.id = id
+        self.type = type
+        self.display_name = display_name
+        self.mail = mail
+
+    @classmethod
+    def select(cls):
+        return 'id,displayName,mail'  # @odata.type is always returned
+
+
+# Incremental parser for one collection page ({"@odata.nextLink": ..., "value": [...]}).
+# Text is fed in chunks as it arrives, items of the "value" array are returned as soon as they are complete,
+# everything else at the top level ends up in annotations. Only the unparsed tail of the body is buffered.
+
+class PageParser:
+    def __init__(self):
+        self.buffer = ''
+        self.position = 0
+        self.state = 'start'
+        self.key = None
+        self.annotations = {}
+
+    def _decode(self, final: bool):
+        try:
+            value, end = _decoder.raw_decode(self.buffer, self.position)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return False, None
+        if end == len(self.buffer) and not final and self.buffer[self.position] not in '{["':
+            return False, None  # A number or literal may continue in the next chunk
+        self.position = end
+        return True, value
+
+    def feed(self, text: str, final: bool = False):
+        self.buffer = self.buffer[self.position:] + text
+        self.position = 0
+        items = []
+        while self.state != 'done':
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position >= len(self.buffer):
+                break
+            char = self.buffer[self.position]
+            if self.state == 'start':
+                if char != '{':
+                    raise ValueError(f"Expected a JSON object, got {char!r}")
+                self.position += 1
+                self.state = 'key'
+            elif self.state == 'key':
+                if char == ',':
+                    self.position += 1
+                    continue
+                if char == '}':
+                    self.position += 1
+                    self.state = 'done'
+                    continue
+                complete, self.key = self._decode(final)
+                if not complete:
+                    break
+                self.state = 'colon'
+            elif self.state == 'colon':
+                if char != ':':
+                    raise ValueError(f"Expected ':' after {self.key!r}, got {char!r}")
+                self.position += 1
+                self.state = 'value'
+            elif self.state == 'value':
+                if self.key == 'value' and char == '[':
+                    self.position += 1
+                    self.state = 'array'
+                    continue
+                complete, value = self._decode(final)
+                if not complete:
+                    break
+                self.annotations[self.key] = value
+                self.state = 'key'
+            elif self.state == 'array':
+                if char == ',':
+                    self.position += 1
+                    continue
+                if char == ']':
+                    self.position += 1
+                    self.state = 'key'
+                    continue
+                complete, value = self._decode(final)
+                if not complete:
+                    break
+                items.append(value)
+        if final and self.state != 'done':
+            raise ValueError("Collection page ended early")
+        return items
+
+
+async def _open(graph_client, url: str, headers=None):
+    response = await graph_client.send("GET", url, headers=headers, stream=True)
+    if response.status_code >= 400:
+        await response.aread()
+        await response.aclose()
+        response.raise_for_status()
+    return response
+
+
+async def _close(pending):
+    # A prefetched page that is no longer needed still holds a pooled connection until it is closed
+    pending.cancel()
+    try:
+        response = await pending
+    except BaseException:
+        return
+    await response.aclose()
+
+
+# Lightweight counterpart of iterate_raw_pages: streams every page of a collection and yields
+# record_type instances without building Kiota models or keeping whole pages in memory.
+# The next page is requested as soon as its @odata.nextLink has been parsed.
+
+async def iterate_records(graph_client, url: str, record_type, headers=None):
+    pending = asyncio.ensure_future(_open(graph_client, url, headers))
+    try:
+        while pending is not None:
+            response = await pending
+            pending = None
+            parser = PageParser()
+            try:
+                async for text in response.aiter_text():
+                    for item in parser.feed(text):
+                        yield record_type.from_json(item)
+                    next_link = parser.annotations.pop('@odata.nextLink', None)
+                    if next_link:
+                        pending = asyncio.ensure_future(_open(graph_client, next_link, headers))
+                for item in parser.feed('', final=True):
+                    yield record_type.from_json(item)
+            finally:
+                await response.aclose()
+            next_link = parser.annotations.get('@odata.nextLink')
+            if next_link and pending is None:
+                pending = asyncio.ensure_future(_open(graph_client, next_link, headers))
+    finally:
+        if pending is not None:
+            await _close(pending)
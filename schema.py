@@ -0,0 +1,98 @@
+import asyncio
+import functools
+import time
+
+
+# Helper function to convert the unreadable extension name into readable form
+# extension_{app id without hyphens}_Home_Town -> Home Town
+# Both name transforms are cached, the same few property names are converted for every object
+
+@functools.lru_cache(maxsize=4096)
+def convert_key(key):
+    sliced_key = key.split('_', 2)[-1]
+    converted_key = sliced_key.replace('_', ' ')
+    return converted_key
+
+
+# Inverse of convert_key for the owner application app_id
+
+@functools.lru_cache(maxsize=4096)
+def transform_key(app_id, key):
+    return f"extension_{app_id.strip().replace('-', '')}_{key.replace(' ', '_')}"
+
+
+# Extension properties registered by one owner application, with the $select list and name mappings precomputed
+
+class ExtensionSchema:
+    def __init__(self, app_id: str, properties: list):
+        self.app_id = app_id.strip()
+        self.properties = [{"Name": convert_key(value["name"]), "ID": value["id"]} for value in properties]
+        self.select = [value["name"] for value in properties]
+        self.readable_names = {value["name"]: convert_key(value["name"]) for value in properties}
+        self.raw_names = {readable: raw for raw, readable in self.readable_names.items()}
+
+    # Raw (extension_...) name of a property, given either its readable or its raw name
+
+    def to_raw(self, key: str):
+        if key in self.readable_names:
+            return key
+        return self.raw_names.get(key) or transform_key(self.app_id, key)
+
+    def to_readable(self, key: str):
+        return self.readable_names.get(key, key)
+
+    def __contains__(self, key: str):
+        return key in self.readable_names or key in self.raw_names
+
+
+# Caches the result of directoryObjects/getAvailableExtensionProperties for ttl seconds.
+# One call serves every owner application (user_dir_app, group_dir_app). Concurrent callers share one refresh.
+# Call invalidate() after creating or deleting extension properties.
+
+class ExtensionSchemaRegistry:
+    def __init__(self, graph_client, ttl: float = 300):
+        self.graph_client = graph_client
+        self.ttl = ttl
+        self.properties = {}
+        self.schemas = {}
+        self.fetched_at = None
+        self.generation = 0  # Bumped by invalidate(), a load that overlaps it does not count as fresh
+        self.lock = asyncio.Lock()
+
+    def _fresh(self):
+        return self.fetched_at is not None and time.monotonic() - self.fetched_at < self.ttl
+
+    async def _load(self):
+        generation = self.generation
+        properties = {}
+        url = "/directoryObjects/getAvailableExtensionProperties"
+        result = await self.graph_client.send_json("POST", url, {"isSyncedFromOnPremises": False})
+        while True:
+            for value in result.get("value", []):
+                properties.setdefault(value["name"][10:42], []).append(value)
+            next_link = result.get("@odata.nextLink")
+            if not next_link:
+                break
+            result = await self.graph_client.send_json("GET", next_link)
+        self.properties = properties
+        self.schemas = {}
+        if generation == self.generation:
+            self.fetched_at = time.monotonic()
+
+    # Schema of the owner application app_id (Application (Client) ID, with or without hyphens)
+
+    async def get(self, app_id: str) -> ExtensionSchema:
+        if not self._fresh():
+            async with self.lock:
+                if not self._fresh():
+                    await self._load()
+        key = app_id.strip().replace('-', '')
+        schema = self.schemas.get(key)
+        if schema is None:
+            schema = ExtensionSchema(app_id, self.properties.get(key, []))
+            self.schemas[key] = schema
+        return schema
+
+    def invalidate(self):
+        self.generation += 1
+        self.fetched_at = None
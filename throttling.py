@@ -0,0 +1,231 @@
+import asyncio
+import random
+import time
+import weakref
+from email.utils import parsedate_to_datetime
+import httpx
+
+# Responses that mean "slow down and try again"
+RETRY_STATUSES = {429, 503, 504}
+
+
+# Seconds to wait before retrying: Retry-After when Graph sends it, jittered exponential backoff otherwise
+
+def retry_delay(headers, attempt: int, base_delay: float = 0.5, max_delay: float = 60.0):
+    headers = {key.lower(): value for key, value in (headers or {}).items()}
+    retry_after = headers.get('retry-after')
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            # Never retry before Retry-After, spread the retries of concurrent callers slightly after it
+            return max(delay, 0) + random.uniform(0, base_delay)
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+# Token bucket: rate requests per second on average, bursts of up to capacity
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Concurrency limit with additive increase / multiplicative decrease.
+# Each healthy response grows the limit by about one per window of responses, a throttled response
+# halves it (at most once per cooldown, so one burst of 429s counts as a single signal).
+
+class AdaptiveLimiter:
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = None, decrease: float = 0.5,
+                 cooldown: float = 1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.decreased_at = 0.0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, throttled: bool):
+        async with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self.decreased_at >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self.decreased_at = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    # Give back a slot that was never used (The request was cancelled before it was sent), the limit is left alone
+
+    async def abandon(self):
+        async with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+
+# Graph throttles per workload (users, groups, applications, ...) as well as per tenant
+
+def workload_of(path: str):
+    parts = [part for part in path.split('/') if part]
+    if parts and parts[0] in ('v1.0', 'beta'):
+        parts = parts[1:]
+    return parts[0] if parts else ''
+
+
+# Rate and concurrency state shared by every client of one tenant.
+# A 429 with Retry-After pauses all requests of the tenant until it has passed.
+
+class ThrottleController:
+    def __init__(self, requests_per_second: float = 50, burst: int = 100, max_concurrency: int = 32,
+                 workload_concurrency: int = 16, min_concurrency: int = 1):
+        self.bucket = TokenBucket(requests_per_second, burst)
+        self.tenant_limiter = AdaptiveLimiter(max_concurrency, min_concurrency)
+        self.workload_concurrency = workload_concurrency
+        self.min_concurrency = min_concurrency
+        self.workload_limiters = {}
+        self.paused_until = 0.0
+
+    def workload_limiter(self, workload: str):
+        limiter = self.workload_limiters.get(workload)
+        if limiter is None:
+            limiter = AdaptiveLimiter(self.workload_concurrency, self.min_concurrency)
+            self.workload_limiters[workload] = limiter
+        return limiter
+
+    def pause(self, delay: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+    # Returns the seconds spent waiting for the pause, the bucket and the concurrency limits
+
+    async def acquire(self, workload: str):
+        started = time.monotonic()
+        while time.monotonic() < self.paused_until:
+            await asyncio.sleep(self.paused_until - time.monotonic())
+        await self.bucket.acquire()
+        await self.tenant_limiter.acquire()
+        try:
+            await self.workload_limiter(workload).acquire()
+        except BaseException:
+            # Cancelled while waiting for the workload (e.g. a prefetched page nobody reads), keep the tenant slot free
+            await self.tenant_limiter.abandon()
+            raise
+        return time.monotonic() - started
+
+    async def release(self, workload: str, throttled: bool):
+        await self.workload_limiter(workload).release(throttled)
+        await self.tenant_limiter.release(throttled)
+
+
+# Event loop -> {tenant id: controller}. The limiters' locks belong to one event loop, so every loop
+# (e.g. each asyncio.run) gets its own controllers; they go away with the loop or forget_throttle_controllers()
+
+_controllers = weakref.WeakKeyDictionary()
+
+
+# Shared controller for tenant_id on the running event loop. Optional [azure] settings: requestsPerSecond, burst,
+# maxConcurrency, workloadConcurrency, minConcurrency
+
+def get_throttle_controller(tenant_id: str, config=None) -> ThrottleController:
+    controllers = _controllers.setdefault(asyncio.get_running_loop(), {})
+    controller = controllers.get(tenant_id)
+    if controller is None:
+        settings = {}
+        if config is not None:
+            settings = dict(
+                requests_per_second=config.getfloat('requestsPerSecond', fallback=50),
+                burst=config.getint('burst', fallback=100),
+                max_concurrency=config.getint('maxConcurrency', fallback=32),
+                workload_concurrency=config.getint('workloadConcurrency', fallback=16),
+                min_concurrency=config.getint('minConcurrency', fallback=1),
+            )
+        controller = ThrottleController(**settings)
+        controllers[tenant_id] = controller
+    return controller
+
+
+# Drop the controllers of the running event loop (Called by client.close_all_clients)
+
+def forget_throttle_controllers():
+    _controllers.pop(asyncio.get_running_loop(), None)
+
+
+# httpx transport placed beneath the kiota middleware of the shared GraphClient.
+# Every request waits for its tenant's controller, throttled responses are retried after
+# Retry-After / backoff and feed the adaptive concurrency limits.
+# controller is a ThrottleController, or a function returning one, called per request on the running event loop
+# (GraphClient passes get_throttle_controller for its tenant, so a client can be created outside an event loop).
+# Retries and waits are added to request.extensions["graph_metrics"] when present.
+
+class ThrottlingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, transport: httpx.AsyncBaseTransport, controller, max_retries: int = 5,
+                 base_delay: float = 0.5, max_delay: float = 60.0):
+        self.transport = transport
+        self._controller = controller
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @property
+    def controller(self) -> ThrottleController:
+        if isinstance(self._controller, ThrottleController):
+            return self._controller
+        return self._controller()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        await request.aread()  # The body has to be replayable for retries
+        controller = self.controller
+        workload = workload_of(request.url.path)
+        metrics = request.extensions.get('graph_metrics')
+        attempt = 0
+        while True:
+            waited = await controller.acquire(workload)
+            throttled = False
+            try:
+                response = await self.transport.handle_async_request(request)
+                throttled = response.status_code in RETRY_STATUSES
+            finally:
+                await controller.release(workload, throttled)
+            if not throttled or attempt >= self.max_retries:
+                if metrics is not None:
+                    metrics['throttle_wait'] = metrics.get('throttle_wait', 0.0) + waited
+                return response
+            delay = retry_delay(response.headers, attempt, self.base_delay, self.max_delay)
+            if response.status_code == 429:
+                controller.pause(delay)
+            await response.aclose()
+            if metrics is not None:
+                metrics['retries'] = metrics.get('retries', 0) + 1
+                metrics['throttle_wait'] = metrics.get('throttle_wait', 0.0) + waited + delay
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -1,90 +1,135 @@
+from __future__ import annotations
 from configparser import SectionProxy
-from azure.identity.aio import ClientSecretCredential
+from typing import TYPE_CHECKING
 from typing import List
 from typing import Dict
 import string
-import random
-import re
-from kiota_authentication_azure.azure_identity_authentication_provider import (
-    AzureIdentityAuthenticationProvider
-)
-from msgraph import GraphRequestAdapter, GraphServiceClient
-from msgraph.generated.applications.get_available_extension_properties import \
-    get_available_extension_properties_post_request_body
-from msgraph.generated.models.password_profile import PasswordProfile
-from msgraph.generated.models.user import User
-from msgraph.generated.users.users_request_builder import UsersRequestBuilder
+import secrets
+from client import GraphClient, get_graph_client
+from paging import iterate_pages
+from query import Query
+from records import UserRecord, iterate_records
+from schema import convert_key, transform_key
+
+# Only for annotations. The msgraph models and request builders are imported by the methods that use them,
+# importing users does not load the generated msgraph package
+if TYPE_CHECKING:
+    from azure.identity.aio import ClientSecretCredential
+    from msgraph import GraphRequestAdapter, GraphServiceClient
+
+DEFAULT_DOMAIN = 'v2tzs.onmicrosoft.com'
+
+
+# Helper functions
+
+def password_generate_msft():
+    characters = string.digits + string.punctuation + string.ascii_uppercase + string.ascii_lowercase
+    password = ''.join(secrets.choice(characters) for i in range(20))
+    return password
+
+
+# "Jane Doe" -> JaneDoe@domain
+
+def user_principal_name(display_name: str, domain: str):
+    return ''.join([word.capitalize() for word in display_name.split()]) + "@" + domain
+
 
 # Authenticate and initialize Microsoft Graph Client using client credentials flow (Version 1.0.0.a12)
+# The client is shared per tenant and client id, see client.py
 class Users:
     settings: SectionProxy
     client_credential: ClientSecretCredential
-    request_adapter: GraphRequestAdapter
-    app_client: GraphServiceClient
 
-    def __init__(self, config: SectionProxy):
+    def __init__(self, config: SectionProxy, graph_client: GraphClient = None):
         self.settings = config
-        client_id = self.settings['clientId']
-        tenant_id = self.settings['tenantId']
-        client_secret = self.settings['clientSecret']
-        self.client_credential = ClientSecretCredential(tenant_id, client_id, client_secret)
-        auth_provider = AzureIdentityAuthenticationProvider(self.client_credential)  # type: ignore
-        self.request_adapter = GraphRequestAdapter(auth_provider)
-        self.app_client = GraphServiceClient(self.request_adapter)
+        # Credential, token cache and connection pool are shared with every other class using the same app
+        self.graph_client = graph_client or get_graph_client(config)
+        self.client_credential = self.graph_client.client_credential
+
+    # The Kiota adapter and GraphServiceClient are only created when a typed request builder is first used (see client.py)
+
+    @property
+    def request_adapter(self) -> GraphRequestAdapter:
+        return self.graph_client.request_adapter
+
+    @property
+    def app_client(self) -> GraphServiceClient:
+        return self.graph_client.app_client
     
     
     
-    # Get all users in the tenant (Select only DisplayName, id and jobTitle)
-
-    async def get_all_users(self):
+    # Stream all users in the tenant (Select only DisplayName, id and jobTitle)
+    # Follows @odata.nextLink, page_size is sent as $top (Maximum 999 for users)
+    # lightweight=True yields UserRecord objects parsed straight from the response body (No Kiota models, see records.py)
+
+    async def iter_all_users(self, page_size: int = 999, lightweight: bool = False):
+        if lightweight:
+            url = f"/users?$select={UserRecord.select()}&$orderby=displayName&$top={page_size}"
+            async for record in iterate_records(self.graph_client, url, UserRecord):
+                yield record
+            return
+        from msgraph.generated.models.user_collection_response import UserCollectionResponse
+        from msgraph.generated.users.users_request_builder import UsersRequestBuilder
         query_params = UsersRequestBuilder.UsersRequestBuilderGetQueryParameters(
             select=['displayName', 'id', 'jobTitle'],
-            orderby=['displayName']
+            orderby=['displayName'],
+            top=page_size
         )
         request_config = UsersRequestBuilder.UsersRequestBuilderGetRequestConfiguration(
             query_parameters=query_params
         )
-
-        response = await self.app_client.users.get(request_configuration=request_config)
-        users = []
-        for user in response.value:
+        request_info = self.app_client.users.to_get_request_information(request_config)
+        async for user in iterate_pages(self.request_adapter, request_info, UserCollectionResponse):
             user_data = {}
             user_data['Name'] = user.display_name
             user_data['id'] = user.id
-            job_title = user.job_title
-            user_data["jobTitle"] = job_title
+            user_data["jobTitle"] = user.job_title
+            yield user_data
+
+    # Query builder for users, filtered, searched and counted by Graph instead of in Python (see query.py)
+    # e.g. await users.query().filter(extension('Domicile') == 'Oslo').select(extensions=['Domicile']).all()
+
+    def query(self):
+        return Query(self.graph_client, "/users", 'user_dir_app', ['displayName', 'id', 'jobTitle'])
+
+    # Get all users in the tenant as a list (Use iter_all_users for large tenants)
+
+    async def get_all_users(self, page_size: int = 999, lightweight: bool = False):
+        users = []
+        async for user_data in self.iter_all_users(page_size, lightweight):
             users.append(user_data)
-        return user_data
+        return users
     
     # Update directory extension properties of the user
     # user_dir_app is the directory extension application ID for users
     # Ensure that the property has been added to the tenant before updating
+    # Updates of the same user made within the client's patchWindow are sent as one PATCH (see coalescing.py)
 
     async def update_user(self, user_id, property_name: str, property_value: str):
+        await self.update_user_properties(user_id, {property_name: property_value})
+
+    # Update several properties of the user in one PATCH
+    # extensions is keyed by readable directory extension name, properties by Graph property name (e.g. jobTitle)
+
+    async def update_user_properties(self, user_id, extensions: dict = None, properties: dict = None):
         user_dir_app = self.settings['user_dir_app']
-        dir_property = f"extension_{re.sub('-', '', user_dir_app)}_" + property_name.replace(" ", "_")
-        request_body = User()
-        additional_data = {f"{dir_property}": None}
-        additional_data[f"{dir_property}"] = property_value
-        request_body.additional_data = additional_data
-        result = await self.app_client.users.by_user_id(user_id).patch(request_body)
-        pass
+        request_body = dict(properties or {})
+        for property_name, property_value in (extensions or {}).items():
+            request_body[transform_key(user_dir_app, property_name)] = property_value
+        await self.graph_client.patches.update('users', user_id, request_body)
 
     # Create a single user (Input user properties in a dictionary format. The minimum requirement is Name)
+    # extensions is an optional dictionary of directory extension values keyed by readable property name,
+    # they are set in the same request. Ensure that the properties are defined in the tenant.
+    # The domain of the user principal name is read from the optional "domain" setting in config.cfg
 
-    async def user_creation_singular(self, user_properties):
-        # app_id = self.settings['user_dir_app'] Optional if using directory extensions
+    async def user_creation_singular(self, user_properties, extensions: dict = None):
+        from msgraph.generated.models.password_profile import PasswordProfile
+        from msgraph.generated.models.user import User
         request_body = User()
         request_body.account_enabled = True
         display_name = user_properties['Name']
-        mail = ''.join([word.capitalize() for word in display_name.split()]) + "@v2tzs.onmicrosoft.com"
-        # Helper functions
-
-        def password_generate_msft():
-            characters = string.digits + string.punctuation + string.ascii_uppercase + string.ascii_lowercase
-            password = ''.join(random.choice(characters) for i in range(20))
-            return password
-
+        mail = user_principal_name(display_name, self.settings.get('domain') or DEFAULT_DOMAIN)
         password = password_generate_msft()
         request_body.display_name = display_name
         request_body.mail_nickname = ''.join([word.capitalize() for word in display_name.split()])
@@ -94,18 +139,13 @@ class Users:
         password_profile.force_change_password_next_sign_in = True
         password_profile.password = password
         request_body.password_profile = password_profile
+        if user_properties.get("JobTitle"):
+            request_body.job_title = user_properties["JobTitle"]
 
         # Optional parameters (Directory extensions)
-        # Ensure that the properties are defined in the tenant before removing code comments
-
-        # request_body.job_title = user_properties["JobTitle"]  (Optional)
-        # def transform_key(key):
-        #     return f"extension_{re.sub('-', '', app_id)}_{re.sub(' ', '_', key)}"
-
-        # replace_keys = lambda obj: {transform_key(k): replace_keys(v) if isinstance(v, dict) else v for k, v in
-        #                             obj.items()}
-        # additional_data = replace_keys(user_properties)
-        # request_body.additional_data = additional_data
+        if extensions:
+            schema = await self.graph_client.extension_schemas.get(self.settings['user_dir_app'])
+            request_body.additional_data = {schema.to_raw(key): value for key, value in extensions.items()}
 
         result = await self.app_client.users.post(request_body)
         user_id = result.id
@@ -114,27 +154,11 @@ class Users:
     # Get all user information from the user_id (Includes directory extension data)
 
     async def get_user_by_id(self, id_num:str): 
+        from msgraph.generated.users.users_request_builder import UsersRequestBuilder
         application_id = self.settings['user_dir_app']
-        application_id = application_id.strip()
-        extension_request_body = get_available_extension_properties_post_request_body.GetAvailableExtensionPropertiesPostRequestBody()
-        extension_request_body.is_synced_from_on_premises = False
-        result = await self.app_client.directory_objects.get_available_extension_properties.post(
-            extension_request_body)
-        extension_property_names_with_app = []
-        extension_property_names = []
-
-        # Helper function to convert the unreadable additional data into readable form
-        def convert_key(key):
-            sliced_key = key.split('_', 2)[-1]
-            converted_key = re.sub(r'_', ' ', sliced_key)
-            return converted_key
-
-        for value in result.value:
-            if value.name[10:42] == re.sub("-", "", application_id):
-                extension_property_names_with_app.append(value.name)
-                extension_property_names.append(convert_key(value.name))
+        schema = await self.graph_client.extension_schemas.get(application_id)  # Cached, see schema.py
         query_params = UsersRequestBuilder.UsersRequestBuilderGetQueryParameters(
-            select=['displayName', 'id', 'jobTitle'] + [str(value) for value in extension_property_names_with_app],
+            select=['displayName', 'id', 'jobTitle'] + schema.select,
             # Sort by display name
             orderby=['displayName'],
         )
@@ -148,7 +172,7 @@ class Users:
         user_data["jobTitle"] = user.job_title
         user_data['id'] = user.id
         # Similarly, add other properties as required
-        del user.additional_data["@odata.context"]  # Removes unnecessary information in the additional data
+        user.additional_data.pop("@odata.context", None)  # Removes unnecessary information in the additional data
         user_data["properties"] = user.additional_data
         return user_data
     
@@ -161,20 +185,15 @@ class Users:
     # Get all groups a user belongs to  (List of Group IDs)
 
     async def get_groups_of_user(self,user_id):
+        # Direct groups only, across every page. See membership.py for nested groups
+        from msgraph.generated.models.group_collection_response import GroupCollectionResponse
         group_ids = []
-        result = await self.app_client.users.by_user_id(user_id).member_of.graph_group.get()
-        for val in result.value:
+        request_info = self.app_client.users.by_user_id(user_id).member_of.graph_group.to_get_request_information()
+        async for val in iterate_pages(self.request_adapter, request_info, GroupCollectionResponse):
             group_ids.append(val.id)
         return group_ids
     
     # Helper functions
 
-    def password_generate_msft():
-        characters = string.digits + string.punctuation + string.ascii_uppercase + string.ascii_lowercase
-        password = ''.join(random.choice(characters) for i in range(20))
-        return password
-
-    def convert_key(key):
-        sliced_key = key.split('_', 2)[-1]
-        converted_key = re.sub(r'_', ' ', sliced_key)
-        return converted_key
+    password_generate_msft = staticmethod(password_generate_msft)
+    convert_key = staticmethod(convert_key)